@@ -9,14 +9,18 @@ from aws_cdk import (
     RemovalPolicy,
     aws_lambda as _lambda,
     aws_s3 as s3,
+    aws_s3_assets as s3_assets,
     aws_iam as iam,
+    aws_logs as logs,
     aws_stepfunctions as sfn,
     aws_stepfunctions_tasks as tasks,
     aws_apigatewayv2 as apigwv2,
+    aws_apigatewayv2_integrations as apigwv2_integrations,
     aws_glue as glue,
     aws_ssm as ssm,
     aws_bedrock as bedrock,
-    custom_resources as cr,
+    aws_s3vectors as s3vectors,
+    aws_dynamodb as dynamodb,
 )
 from constructs import Construct
 
@@ -38,6 +42,11 @@ class RiftTriviaStack(Stack):
         if not riot_api_key_param_name:
             raise ValueError("riot_api_key_param must be provided in cdk.context.json or via -c riot_api_key_param=...")
         
+        # Optional AWS Parameters and Secrets Lambda Extension layer (arm64 build, region-specific ARN)
+        params_secrets_extension_arn = self.node.try_get_context("params_secrets_extension_arn")
+        # Optional arm64 / Python 3.11 layer providing orjson for the match retrieval Lambda
+        orjson_layer_arn = self.node.try_get_context("orjson_layer_arn")
+
         # Bedrock model ID with sensible default
         bedrock_model_id = self.node.try_get_context("bedrock_model_id") or "anthropic.claude-3-5-sonnet-20241022-v2:0"
 
@@ -62,10 +71,28 @@ class RiftTriviaStack(Stack):
                             transition_after=Duration.days(90),
                         )
                     ],
-                )
+                ),
+                # Match/summary/facts objects are overwritten often; don't keep old versions around
+                s3.LifecycleRule(
+                    id="ExpireNoncurrentVersions",
+                    enabled=True,
+                    noncurrent_version_expiration=Duration.days(7),
+                    abort_incomplete_multipart_upload_after=Duration.days(1),
+                ),
             ],
         )
 
+        # One short-lived row per in-flight puuid/year run, so trigger_step can reject
+        # duplicates with a single conditional write
+        self.lock_table = dynamodb.Table(
+            self,
+            "ExecutionLockTable",
+            partition_key=dynamodb.Attribute(name="pk", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="ttl",
+            removal_policy=RemovalPolicy.DESTROY,  # Only transient locks live here
+        )
+
         # ========================================
         # Bedrock Knowledge Base using S3 Vectors
         # ========================================
@@ -78,9 +105,8 @@ class RiftTriviaStack(Stack):
             description="Role for Bedrock Knowledge Base to access S3 for data and vector storage",
         )
 
-        # Grant S3 read to data source and read/write to vectors prefix
+        # Grant S3 read to data source
         self.data_bucket.grant_read(bedrock_kb_role, "summary/*")
-        self.data_bucket.grant_read_write(bedrock_kb_role, "kb-vectors/*")
 
         # Grant Bedrock model access
         bedrock_kb_role.add_to_policy(
@@ -92,137 +118,142 @@ class RiftTriviaStack(Stack):
             )
         )
 
-        # Create Knowledge Base via Custom Resource to target S3 Vectors (CloudFormation/CDK may not yet expose this)
-        kb_create = cr.AwsCustomResource(
-            self,
-            "CreateS3VectorsKnowledgeBase",
-            on_create=cr.AwsSdkCall(
-                service="Bedrock",
-                action="CreateKnowledgeBase",
-                parameters={
-                    "Name": "rift-trivia-kb",
-                    "Description": "Knowledge base for Rift Trivia quiz generation from player summaries",
-                    "RoleArn": bedrock_kb_role.role_arn,
-                    "KnowledgeBaseConfiguration": {
-                        "Type": "VECTOR",
-                        "VectorKnowledgeBaseConfiguration": {
-                            "EmbeddingModelArn": f"arn:aws:bedrock:{self.region}::foundation-model/amazon.titan-embed-text-v2:0",
-                        },
-                    },
-                    "StorageConfiguration": {
-                        "Type": "S3",
-                        "S3Configuration": {
-                            "BucketArn": self.data_bucket.bucket_arn,
-                            # Optionally specify a prefix for vector files written by Bedrock
-                            # "ObjectKeyPrefix": "kb-vectors/",
-                        },
-                    },
-                },
-                physical_resource_id=cr.PhysicalResourceId.from_response("knowledgeBase.KnowledgeBaseId"),
+        # S3 Vectors bucket + index backing the Knowledge Base (titan-embed-text-v2 emits 1024-dim vectors)
+        vector_bucket = s3vectors.CfnVectorBucket(
+            self,
+            "KBVectorBucket",
+        )
+
+        vector_index = s3vectors.CfnIndex(
+            self,
+            "KBVectorIndex",
+            vector_bucket_arn=vector_bucket.attr_vector_bucket_arn,
+            index_name="rift-trivia-index",
+            data_type="float32",
+            dimension=1024,
+            distance_metric="cosine",
+            # Bedrock stores chunk text (and hierarchical parent text) in vector metadata; keep it
+            # out of the filterable metadata so it doesn't hit the filterable size limit
+            metadata_configuration=s3vectors.CfnIndex.MetadataConfigurationProperty(
+                non_filterable_metadata_keys=["AMAZON_BEDROCK_TEXT", "AMAZON_BEDROCK_METADATA"],
             ),
-            on_delete=cr.AwsSdkCall(
-                service="Bedrock",
-                action="DeleteKnowledgeBase",
-                parameters={
-                    "KnowledgeBaseId": cr.PhysicalResourceIdReference(),
-                },
+        )
+
+        # Grant vector read/write on the KB's index only
+        bedrock_kb_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "s3vectors:GetIndex",
+                    "s3vectors:PutVectors",
+                    "s3vectors:GetVectors",
+                    "s3vectors:DeleteVectors",
+                    "s3vectors:QueryVectors",
+                ],
+                resources=[vector_index.attr_index_arn],
+            )
+        )
+
+        # Knowledge Base and Data Source as native CloudFormation resources
+        knowledge_base = bedrock.CfnKnowledgeBase(
+            self,
+            "KnowledgeBase",
+            name="rift-trivia-kb",
+            description="Knowledge base for Rift Trivia quiz generation from player summaries",
+            role_arn=bedrock_kb_role.role_arn,
+            knowledge_base_configuration=bedrock.CfnKnowledgeBase.KnowledgeBaseConfigurationProperty(
+                type="VECTOR",
+                vector_knowledge_base_configuration=bedrock.CfnKnowledgeBase.VectorKnowledgeBaseConfigurationProperty(
+                    embedding_model_arn=f"arn:aws:bedrock:{self.region}::foundation-model/amazon.titan-embed-text-v2:0",
+                ),
             ),
-            policy=cr.AwsCustomResourcePolicy.from_statements([
-                iam.PolicyStatement(
-                    actions=[
-                        "bedrock:CreateKnowledgeBase",
-                        "bedrock:DeleteKnowledgeBase",
-                        "bedrock:TagResource",
-                        "bedrock:UntagResource",
-                        "bedrock:UpdateKnowledgeBase",
-                    ],
-                    resources=["*"],
-                )
-            ]),
-        )
-
-        kb_id = kb_create.get_response_field("knowledgeBase.KnowledgeBaseId")
-
-        # Create Data Source via Custom Resource as well
-        ds_create = cr.AwsCustomResource(
-            self,
-            "CreateKnowledgeBaseDataSource",
-            on_create=cr.AwsSdkCall(
-                service="Bedrock",
-                action="CreateDataSource",
-                parameters={
-                    "KnowledgeBaseId": kb_id,
-                    "Name": "rift-trivia-s3-summaries",
-                    "Description": "S3 data source for player summaries",
-                    "DataSourceConfiguration": {
-                        "Type": "S3",
-                        "S3Configuration": {
-                            "BucketArn": self.data_bucket.bucket_arn,
-                            "InclusionPrefixes": ["summary/"],
-                        },
-                    },
-                    "VectorIngestionConfiguration": {
-                        "ChunkingConfiguration": {
-                            "ChunkingStrategy": "FIXED_SIZE",
-                            "FixedSizeChunkingConfiguration": {
-                                "MaxTokens": 300,
-                                "OverlapPercentage": 20,
-                            },
-                        }
-                    },
-                },
-                physical_resource_id=cr.PhysicalResourceId.from_response("dataSource.DataSourceId"),
+            storage_configuration=bedrock.CfnKnowledgeBase.StorageConfigurationProperty(
+                type="S3_VECTORS",
+                s3_vectors_configuration=bedrock.CfnKnowledgeBase.S3VectorsConfigurationProperty(
+                    vector_bucket_arn=vector_bucket.attr_vector_bucket_arn,
+                    index_arn=vector_index.attr_index_arn,
+                ),
             ),
-            on_delete=cr.AwsSdkCall(
-                service="Bedrock",
-                action="DeleteDataSource",
-                parameters={
-                    "KnowledgeBaseId": kb_id,
-                    "DataSourceId": cr.PhysicalResourceIdReference(),
-                },
+        )
+        # The KB validates its role on create, so the policy must exist first
+        knowledge_base.node.add_dependency(bedrock_kb_role)
+
+        kb_id = knowledge_base.attr_knowledge_base_id
+
+        data_source = bedrock.CfnDataSource(
+            self,
+            "KnowledgeBaseDataSource",
+            knowledge_base_id=kb_id,
+            name="rift-trivia-s3-summaries",
+            description="S3 data source for player summaries",
+            data_source_configuration=bedrock.CfnDataSource.DataSourceConfigurationProperty(
+                type="S3",
+                s3_configuration=bedrock.CfnDataSource.S3DataSourceConfigurationProperty(
+                    bucket_arn=self.data_bucket.bucket_arn,
+                    inclusion_prefixes=["summary/"],
+                ),
+            ),
+            vector_ingestion_configuration=bedrock.CfnDataSource.VectorIngestionConfigurationProperty(
+                # Parent chunks give the model whole summary sections; small child chunks keep
+                # retrieval precise without the redundant embeddings of percentage overlap
+                chunking_configuration=bedrock.CfnDataSource.ChunkingConfigurationProperty(
+                    chunking_strategy="HIERARCHICAL",
+                    hierarchical_chunking_configuration=bedrock.CfnDataSource.HierarchicalChunkingConfigurationProperty(
+                        level_configurations=[
+                            bedrock.CfnDataSource.HierarchicalChunkingLevelConfigurationProperty(max_tokens=1500),
+                            bedrock.CfnDataSource.HierarchicalChunkingLevelConfigurationProperty(max_tokens=300),
+                        ],
+                        overlap_tokens=15,  # ~5% of a child chunk; summaries are small and self-contained
+                    ),
+                ),
             ),
-            policy=cr.AwsCustomResourcePolicy.from_statements([
-                iam.PolicyStatement(
-                    actions=[
-                        "bedrock:CreateDataSource",
-                        "bedrock:DeleteDataSource",
-                        "bedrock:UpdateDataSource",
-                        "bedrock:TagResource",
-                        "bedrock:UntagResource",
-                    ],
-                    resources=["*"],
-                )
-            ]),
         )
 
-        ds_id = ds_create.get_response_field("dataSource.DataSourceId")
+        ds_id = data_source.attr_data_source_id
 
         # ========================================
         # WebSocket API Gateway
         # ========================================
-        self.websocket_api = apigwv2.CfnApi(
+        self.websocket_api = apigwv2.WebSocketApi(
             self,
             "WebSocketApi",
-            name="RiftTriviaWebSocket",
-            protocol_type="WEBSOCKET",
+            api_name="RiftTriviaWebSocket",
             route_selection_expression="$request.body.action",
         )
 
-        self.websocket_stage = apigwv2.CfnStage(
+        self.websocket_stage = apigwv2.WebSocketStage(
             self,
             "WebSocketStage",
-            api_id=self.websocket_api.ref,
+            web_socket_api=self.websocket_api,
             stage_name="production",
             auto_deploy=True,
         )
 
-        websocket_endpoint = f"https://{self.websocket_api.ref}.execute-api.{self.region}.amazonaws.com/production"
+        websocket_endpoint = self.websocket_stage.callback_url
 
         # ========================================
         # IAM Roles
         # ========================================
         
-        # Lambda execution role with broad permissions
+        # State machine names are fixed, so their ARNs can be built up front instead of
+        # referencing the constructs (which would make the role depend on the state machines)
+        state_machine_name = "rift-rewind"
+        state_machine_arn = f"arn:aws:states:{self.region}:{self.account}:stateMachine:{state_machine_name}"
+        fast_state_machine_name = "rift-rewind-fast"
+        fast_state_machine_arn = f"arn:aws:states:{self.region}:{self.account}:stateMachine:{fast_state_machine_name}"
+
+        # Generation model ARNs. Cross-region inference profile IDs (e.g. "apac.anthropic...")
+        # also need the underlying foundation model in every region the profile routes to.
+        model_prefix, _, base_model_id = bedrock_model_id.partition(".")
+        if model_prefix in ("us", "eu", "apac", "global"):
+            bedrock_model_arns = [
+                f"arn:aws:bedrock:{self.region}:{self.account}:inference-profile/{bedrock_model_id}",
+                f"arn:aws:bedrock:*::foundation-model/{base_model_id}",
+            ]
+        else:
+            bedrock_model_arns = [f"arn:aws:bedrock:{self.region}::foundation-model/{bedrock_model_id}"]
+
+        # Lambda execution role with broad permissions. All statements are declared in one
+        # document; @aws-cdk/aws-iam:minimizePolicies (cdk.json) merges any that share actions.
         lambda_role = iam.Role(
             self,
             "LambdaExecutionRole",
@@ -230,45 +261,59 @@ class RiftTriviaStack(Stack):
             managed_policies=[
                 iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSLambdaBasicExecutionRole"),
             ],
+            inline_policies={
+                "LambdaExecutionPolicy": iam.PolicyDocument(
+                    statements=[
+                        # SSM parameter access
+                        iam.PolicyStatement(
+                            actions=["ssm:GetParameter"],
+                            resources=[f"arn:aws:ssm:{self.region}:{self.account}:parameter{riot_api_key_param_name}"],
+                        ),
+                        # WebSocket API access
+                        iam.PolicyStatement(
+                            actions=["execute-api:ManageConnections"],
+                            resources=[f"arn:aws:execute-api:{self.region}:{self.account}:{self.websocket_api.api_id}/*"],
+                        ),
+                        # Bedrock access, scoped to the generation model and the Knowledge Base
+                        iam.PolicyStatement(
+                            actions=["bedrock:InvokeModel"],
+                            resources=bedrock_model_arns,
+                        ),
+                        iam.PolicyStatement(
+                            actions=["bedrock:Retrieve"],
+                            resources=[knowledge_base.attr_knowledge_base_arn],
+                        ),
+                        iam.PolicyStatement(
+                            actions=["bedrock:RetrieveAndGenerate"],
+                            resources=["*"],  # RetrieveAndGenerate doesn't support resource-level permissions
+                        ),
+                        # State machine access
+                        iam.PolicyStatement(
+                            actions=["states:StartExecution"],
+                            resources=[state_machine_arn, fast_state_machine_arn],
+                        ),
+                    ],
+                ),
+            },
         )
 
         # Grant S3 access
         self.data_bucket.grant_read_write(lambda_role)
-
-        # Grant SSM parameter access
-        lambda_role.add_to_policy(
-            iam.PolicyStatement(
-                actions=["ssm:GetParameter"],
-                resources=[f"arn:aws:ssm:{self.region}:{self.account}:parameter{riot_api_key_param_name}"],
-            )
-        )
-
-        # Grant WebSocket API access
-        lambda_role.add_to_policy(
-            iam.PolicyStatement(
-                actions=["execute-api:ManageConnections"],
-                resources=[f"arn:aws:execute-api:{self.region}:{self.account}:{self.websocket_api.ref}/*"],
-            )
-        )
-
-        # Grant Bedrock access
-        lambda_role.add_to_policy(
-            iam.PolicyStatement(
-                actions=["bedrock:InvokeModel", "bedrock:Retrieve", "bedrock:RetrieveAndGenerate"],
-                resources=["*"],  # Bedrock doesn't support resource-level permissions yet
-            )
-        )
+        self.lock_table.grant_read_write_data(lambda_role)
 
         # ========================================
         # Lambda Functions
         # ========================================
 
+        # Single code asset shared by every function (one hash, one upload)
+        lambda_code = _lambda.Code.from_asset("../lambda")
+
         # Common environment variables
         common_env = {
             "S3_BUCKET": self.data_bucket.bucket_name,
             "RIOT_API_KEY_SSM_PARAM": riot_api_key_param_name,
             "API_GATEWAY_ENDPOINT": websocket_endpoint,
-            "AWS_REGION": self.region,
+            # AWS_REGION is reserved and injected by the Lambda runtime
         }
 
         # 1. Riot API Function
@@ -276,8 +321,9 @@ class RiftTriviaStack(Stack):
             self,
             "CallRiotApi",
             runtime=_lambda.Runtime.PYTHON_3_11,
+            architecture=_lambda.Architecture.ARM_64,
             handler="call_riot_api.lambda_handler",
-            code=_lambda.Code.from_asset("../lambda"),
+            code=lambda_code,
             role=lambda_role,
             timeout=Duration.seconds(60),
             memory_size=256,
@@ -300,8 +346,9 @@ class RiftTriviaStack(Stack):
             self,
             "RetrieveMatchDataFunction",
             runtime=_lambda.Runtime.PYTHON_3_11,
+            architecture=_lambda.Architecture.ARM_64,
             handler="retrieve_match_data.lambda_handler",
-            code=_lambda.Code.from_asset("../lambda"),
+            code=lambda_code,
             role=lambda_role,
             timeout=Duration.seconds(300),  # 5 minutes for API-heavy operations
             memory_size=512,
@@ -309,36 +356,48 @@ class RiftTriviaStack(Stack):
             description="Retrieves match history from Riot API and stores in S3",
         )
 
+        # Serve the Riot API key SSM reads from the extension's local cache when configured
+        if params_secrets_extension_arn:
+            params_secrets_extension = _lambda.LayerVersion.from_layer_version_arn(
+                self, "ParamsSecretsExtension", params_secrets_extension_arn
+            )
+            for fn in (self.call_riot_api, self.retrieve_match):
+                fn.add_layers(params_secrets_extension)
+                fn.add_environment("SSM_PARAMETER_STORE_TTL", "300")
+                # Also tells the handlers the extension is there to be queried
+                fn.add_environment("PARAMETERS_SECRETS_EXTENSION_HTTP_PORT", "2773")
+
+        # Parse the Riot match payloads with orjson when a layer for it is configured
+        if orjson_layer_arn:
+            self.retrieve_match.add_layers(
+                _lambda.LayerVersion.from_layer_version_arn(self, "OrjsonLayer", orjson_layer_arn)
+            )
+
         # 3. Generate Facts Function
         self.generate_facts = _lambda.Function(
             self,
             "GenerateFactsFunction",
-            runtime=_lambda.Runtime.PYTHON_3_11,
+            runtime=_lambda.Runtime.PYTHON_3_12,  # SnapStart requires Python 3.12+
+            architecture=_lambda.Architecture.ARM_64,
             handler="generate_facts.lambda_handler",
-            code=_lambda.Code.from_asset("../lambda"),
+            code=lambda_code,
             role=lambda_role,
             timeout=Duration.seconds(300),
             memory_size=1024,  # More memory for Bedrock operations
-            environment={
-                **common_env,
+            environment=common_env | {
                 "BEDROCK_KB_ID": kb_id,
                 "BEDROCK_MODEL_ID": bedrock_model_id,
             },
             description="Generates quiz facts using AWS Bedrock and RAG",
+            snap_start=_lambda.SnapStartConf.ON_PUBLISHED_VERSIONS,
         )
 
-        # 4. Send Fail Message Function
-        self.send_fail_message = _lambda.Function(
+        # SnapStart only applies to published versions, so the state machines invoke an alias
+        self.generate_facts_alias = _lambda.Alias(
             self,
-            "SendFailMessageFunction",
-            runtime=_lambda.Runtime.PYTHON_3_11,
-            handler="send_fail_message.lambda_handler",
-            code=_lambda.Code.from_asset("../lambda"),
-            role=lambda_role,
-            timeout=Duration.seconds(30),
-            memory_size=128,
-            environment={"API_GATEWAY_ENDPOINT": websocket_endpoint},
-            description="Sends failure notifications via WebSocket",
+            "GenerateFactsLiveAlias",
+            alias_name="live",
+            version=self.generate_facts.current_version,
         )
 
         # ========================================
@@ -357,16 +416,13 @@ class RiftTriviaStack(Stack):
 
         self.data_bucket.grant_read_write(glue_role)
 
-        # Upload Glue script to S3
-        from aws_cdk import aws_s3_deployment as s3deploy
-
-        glue_scripts_deployment = s3deploy.BucketDeployment(
+        # Upload Glue script to S3 through the standard CDK asset pipeline
+        glue_script = s3_assets.Asset(
             self,
-            "GlueScriptsDeployment",
-            sources=[s3deploy.Source.asset("../glue")],
-            destination_bucket=self.data_bucket,
-            destination_key_prefix="glue-scripts",
+            "GlueScript",
+            path="../glue/match-summary.py",
         )
+        glue_script.grant_read(glue_role)
 
         # Create Glue job
         self.glue_job = glue.CfnJob(
@@ -377,19 +433,31 @@ class RiftTriviaStack(Stack):
             command=glue.CfnJob.JobCommandProperty(
                 name="glueetl",
                 python_version="3",
-                script_location=f"s3://{self.data_bucket.bucket_name}/glue-scripts/match-summary.py",
+                script_location=glue_script.s3_object_url,
             ),
             default_arguments={
                 "--job-language": "python",
                 "--S3_BUCKET": self.data_bucket.bucket_name,
                 "--enable-metrics": "true",
+                "--enable-auto-scaling": "true",
                 "--enable-continuous-cloudwatch-log": "true",
                 "--enable-spark-ui": "true",
                 "--spark-event-logs-path": f"s3://{self.data_bucket.bucket_name}/spark-logs/",
+                # Each run re-aggregates a player's whole year, so bookmarks must stay off
+                "--job-bookmark-option": "job-bookmark-disable",
+                "--additional-python-modules": "orjson==3.10.7",
+                "--conf": (
+                    "spark.sql.adaptive.enabled=true"
+                    " --conf spark.sql.adaptive.coalescePartitions.enabled=true"
+                    " --conf spark.sql.adaptive.skewJoin.enabled=true"
+                ),
             },
             glue_version="4.0",
-            max_capacity=2.0,
-            timeout=60,  # 60 minutes
+            worker_type="G.1X",
+            number_of_workers=5,  # Upper bound; auto scaling releases idle workers
+            # Just under RunGlueETL's 20 min task timeout, so Glue stops the run itself (and the
+            # task fails into the catch) rather than leaving it billing after the lock is released
+            timeout=19,  # minutes
             description="PySpark ETL job to aggregate match data into summaries",
         )
 
@@ -402,35 +470,22 @@ class RiftTriviaStack(Stack):
             self,
             "TriggerStepFunction",
             runtime=_lambda.Runtime.PYTHON_3_11,
+            architecture=_lambda.Architecture.ARM_64,
             handler="trigger_step.lambda_handler",
-            code=_lambda.Code.from_asset("../lambda"),
+            code=lambda_code,
             role=lambda_role,
             timeout=Duration.seconds(60),
-            memory_size=256,
+            memory_size=512,  # SigV4/TLS for StartExecution is CPU-bound below ~512 MB
             environment={
                 "API_GATEWAY_ENDPOINT": websocket_endpoint,
+                "LOCK_TABLE_NAME": self.lock_table.table_name,
                 "STATE_MACHINE_ARN": "PLACEHOLDER",  # Will be updated after state machine creation
+                "FAST_STATE_MACHINE_ARN": "PLACEHOLDER",
             },
             description="Triggers Step Functions execution and checks for duplicates",
         )
 
-        # State machine tasks
-        assign_var_task = sfn.Pass(
-            self,
-            "AssignVar",
-            parameters={
-                "puuid": sfn.JsonPath.string_at("$.puuid"),
-                "year": sfn.JsonPath.string_at("$.year"),
-                "final_exists": sfn.JsonPath.string_at("$.final_exists"),
-                "summary_exists": sfn.JsonPath.string_at("$.summary_exists"),
-                "routing_value": sfn.JsonPath.string_at("$.routing_value"),
-                "connection_id": sfn.JsonPath.string_at("$.connection_id"),
-            },
-            result_path="$.vars",
-        )
-
-        # Check if final exists
-        final_exists_choice = sfn.Choice(self, "FinalExists?")
+        # State machine tasks (fields are read straight from the execution input)
 
         # Check if summary exists
         summary_exists_choice = sfn.Choice(self, "SummaryExists?")
@@ -441,10 +496,10 @@ class RiftTriviaStack(Stack):
             "RetrieveMatchData",
             lambda_function=self.retrieve_match,
             payload=sfn.TaskInput.from_object({
-                "puuid": sfn.JsonPath.string_at("$.vars.puuid"),
-                "year": sfn.JsonPath.string_at("$.vars.year"),
-                "routing_value": sfn.JsonPath.string_at("$.vars.routing_value"),
-                "connection_id": sfn.JsonPath.string_at("$.vars.connection_id"),
+                "puuid": sfn.JsonPath.string_at("$.puuid"),
+                "year": sfn.JsonPath.string_at("$.year"),
+                "routing_value": sfn.JsonPath.string_at("$.routing_value"),
+                "connectionId": sfn.JsonPath.string_at("$.connectionId"),
             }),
             result_path="$.retrieve_result",
         )
@@ -455,10 +510,12 @@ class RiftTriviaStack(Stack):
             "RunGlueETL",
             glue_job_name=self.glue_job.name,
             arguments=sfn.TaskInput.from_object({
-                "--puuid": sfn.JsonPath.string_at("$.vars.puuid"),
-                "--year": sfn.JsonPath.string_at("$.vars.year"),
+                "--puuid": sfn.JsonPath.string_at("$.puuid"),
+                "--year": sfn.JsonPath.format("{}", sfn.JsonPath.string_at("$.year")),  # Glue arguments must be strings
             }),
             integration_pattern=sfn.IntegrationPattern.RUN_JOB,  # Wait for completion
+            # Fail into the catch (and notify the client) well before the 30 min execution timeout
+            task_timeout=sfn.Timeout.duration(Duration.minutes(20)),
             result_path="$.glue_result",
         )
 
@@ -475,11 +532,12 @@ class RiftTriviaStack(Stack):
         generate_facts_task = tasks.LambdaInvoke(
             self,
             "GenerateFacts",
-            lambda_function=self.generate_facts,
+            lambda_function=self.generate_facts_alias,
             payload=sfn.TaskInput.from_object({
-                "puuid": sfn.JsonPath.string_at("$.vars.puuid"),
-                "year": sfn.JsonPath.string_at("$.vars.year"),
-                "connection_id": sfn.JsonPath.string_at("$.vars.connection_id"),
+                "puuid": sfn.JsonPath.string_at("$.puuid"),
+                "year": sfn.JsonPath.string_at("$.year"),
+                "final_exists": sfn.JsonPath.string_at("$.final_exists"),
+                "connectionId": sfn.JsonPath.string_at("$.connectionId"),
             }),
             result_path="$.generate_result",
         )
@@ -487,103 +545,150 @@ class RiftTriviaStack(Stack):
         # Success state
         success_state = sfn.Succeed(self, "Success")
 
-        # Fail handler
-        fail_handler = tasks.LambdaInvoke(
-            self,
-            "SendFailMessage",
-            lambda_function=self.send_fail_message,
-            payload=sfn.TaskInput.from_object({
-                "connection_id": sfn.JsonPath.string_at("$.vars.connection_id"),
-                "error": sfn.JsonPath.string_at("$.error"),
-            }),
+        # Release trigger_step's puuid/year lock once the run has finished either way
+        def release_lock_task(construct_id):
+            return tasks.DynamoDeleteItem(
+                self,
+                construct_id,
+                table=self.lock_table,
+                key={
+                    "pk": tasks.DynamoAttributeValue.from_string(
+                        sfn.JsonPath.format(
+                            "{}#{}",
+                            sfn.JsonPath.string_at("$.puuid"),
+                            sfn.JsonPath.string_at("$.year"),
+                        )
+                    )
+                },
+                result_path=sfn.JsonPath.DISCARD,
+            )
+
+        release_lock = release_lock_task("ReleaseLock")
+        release_lock_on_failure = release_lock_task("ReleaseLockOnFailure")
+
+        # Fail handler: POST {"state":"FAIL"} to the client's @connections URL straight from
+        # Step Functions (signed with the state machine role). The aws-sdk integration for
+        # apigatewaymanagementapi can't target the API's own endpoint, so use apigateway:invoke.
+        def fail_message_state(construct_id):
+            return sfn.CustomState(
+                self,
+                construct_id,
+                state_json={
+                    "Type": "Task",
+                    "Resource": "arn:aws:states:::apigateway:invoke",
+                    "Parameters": {
+                        "ApiEndpoint": f"{self.websocket_api.api_id}.execute-api.{self.region}.amazonaws.com",
+                        "Method": "POST",
+                        "Stage": self.websocket_stage.stage_name,
+                        "Path.$": "States.Format('@connections/{}', $.connectionId)",
+                        "AuthType": "IAM_ROLE",
+                        "RequestBody": {"state": "FAIL"},
+                    },
+                    "ResultPath": None,
+                },
+            )
+
+        manage_connections_policy = iam.PolicyStatement(
+            actions=["execute-api:ManageConnections"],
+            resources=[
+                f"arn:aws:execute-api:{self.region}:{self.account}:{self.websocket_api.api_id}"
+                f"/{self.websocket_stage.stage_name}/POST/@connections/*"
+            ],
         )
 
+        fail_handler = fail_message_state("SendFailMessage")
+
         fail_state = sfn.Fail(self, "Failed", cause="Workflow failed", error="WorkflowError")
 
-        # Build the workflow
+        # Build the workflow. Requests with final facts already in S3 never reach this
+        # machine; trigger_step sends them to the EXPRESS fast path below.
         definition = (
-            assign_var_task
-            .next(final_exists_choice
-                .when(sfn.Condition.boolean_equals("$.vars.final_exists", True), generate_facts_task)
-                .otherwise(summary_exists_choice
-                    .when(sfn.Condition.boolean_equals("$.vars.summary_exists", True), bedrock_ingestion_note)
-                    .otherwise(retrieve_match_task.next(glue_job_task).next(bedrock_ingestion_note))
-                )
-            )
+            summary_exists_choice
+            .when(sfn.Condition.boolean_equals("$.summary_exists", True), bedrock_ingestion_note)
+            .otherwise(retrieve_match_task.next(glue_job_task).next(bedrock_ingestion_note))
         )
 
         # Connect all paths to generate_facts -> success
         bedrock_ingestion_note.next(generate_facts_task)
-        generate_facts_task.next(success_state)
-
-        # Add error handling
-        retrieve_match_task.add_catch(fail_handler, result_path="$.error")
-        glue_job_task.add_catch(fail_handler, result_path="$.error")
-        generate_facts_task.add_catch(fail_handler, result_path="$.error")
+        generate_facts_task.next(release_lock).next(success_state)
+
+        # Add error handling: free the lock first so the client can retry straight away
+        retrieve_match_task.add_catch(release_lock_on_failure, result_path="$.error")
+        glue_job_task.add_catch(release_lock_on_failure, result_path="$.error")
+        generate_facts_task.add_catch(release_lock_on_failure, result_path="$.error")
+        # A lock that can't be deleted just expires; the client must still be told
+        release_lock_on_failure.add_catch(fail_handler, result_path=sfn.JsonPath.DISCARD)
+        release_lock_on_failure.next(fail_handler)
+        # A client that already disconnected (410) just ends the run as failed
+        fail_handler.add_catch(fail_state, result_path=sfn.JsonPath.DISCARD)
         fail_handler.next(fail_state)
 
         # Create state machine
         self.state_machine = sfn.StateMachine(
             self,
             "RiftTriviaStateMachine",
-            state_machine_name="rift-rewind",
+            state_machine_name=state_machine_name,
             definition=definition,
             timeout=Duration.minutes(30),
         )
+        self.state_machine.add_to_role_policy(manage_connections_policy)
 
-        # Grant state machine permissions
-        lambda_role.add_to_policy(
-            iam.PolicyStatement(
-                actions=[
-                    "states:StartExecution",
-                    "states:ListExecutions",
-                    "states:DescribeExecution",
-                ],
-                resources=[self.state_machine.state_machine_arn],
-            )
+        # Fast path: cached facts are read from S3 and pushed to the client. EXPRESS
+        # workflows are billed per request rather than per state transition.
+        cached_facts_task = tasks.LambdaInvoke(
+            self,
+            "GenerateFactsCached",
+            lambda_function=self.generate_facts_alias,
+            payload=sfn.TaskInput.from_object({
+                "puuid": sfn.JsonPath.string_at("$.puuid"),
+                "year": sfn.JsonPath.string_at("$.year"),
+                "final_exists": sfn.JsonPath.string_at("$.final_exists"),
+                "connectionId": sfn.JsonPath.string_at("$.connectionId"),
+            }),
+            result_path="$.generate_result",
         )
 
-        # Update trigger function with actual state machine ARN
-        self.trigger_step.add_environment("STATE_MACHINE_ARN", self.state_machine.state_machine_arn)
+        cached_fail_handler = fail_message_state("SendFailMessageCached")
+        cached_fail_state = sfn.Fail(self, "CachedFailed", cause="Workflow failed", error="WorkflowError")
 
-        # ========================================
-        # WebSocket API Integrations
-        # ========================================
-
-        # Lambda permission for API Gateway
-        self.trigger_step.grant_invoke(iam.ServicePrincipal("apigateway.amazonaws.com"))
+        cached_facts_task.add_catch(cached_fail_handler, result_path="$.error")
+        cached_fail_handler.add_catch(cached_fail_state, result_path=sfn.JsonPath.DISCARD)
+        cached_fail_handler.next(cached_fail_state)
 
-        # Integration
-        integration = apigwv2.CfnIntegration(
+        self.fast_state_machine = sfn.StateMachine(
             self,
-            "TriggerStepIntegration",
-            api_id=self.websocket_api.ref,
-            integration_type="AWS_PROXY",
-            integration_uri=f"arn:aws:apigateway:{self.region}:lambda:path/2015-03-31/functions/{self.trigger_step.function_arn}/invocations",
+            "RiftTriviaFastStateMachine",
+            state_machine_name=fast_state_machine_name,
+            state_machine_type=sfn.StateMachineType.EXPRESS,
+            definition=cached_facts_task.next(sfn.Succeed(self, "CachedSuccess")),
+            timeout=Duration.minutes(5),
+            logs=sfn.LogOptions(
+                destination=logs.LogGroup(
+                    self,
+                    "FastStateMachineLogs",
+                    retention=logs.RetentionDays.ONE_WEEK,
+                ),
+                level=sfn.LogLevel.ERROR,
+            ),
         )
+        self.fast_state_machine.add_to_role_policy(manage_connections_policy)
 
-        # Default route
-        default_route = apigwv2.CfnRoute(
-            self,
-            "DefaultRoute",
-            api_id=self.websocket_api.ref,
-            route_key="$default",
-            target=f"integrations/{integration.ref}",
-        )
+        # Update trigger function with actual state machine ARNs
+        self.trigger_step.add_environment("STATE_MACHINE_ARN", self.state_machine.state_machine_arn)
+        self.trigger_step.add_environment("FAST_STATE_MACHINE_ARN", self.fast_state_machine.state_machine_arn)
 
-        # Connect/Disconnect routes (no integration needed)
-        connect_route = apigwv2.CfnRoute(
-            self,
-            "ConnectRoute",
-            api_id=self.websocket_api.ref,
-            route_key="$connect",
-        )
+        # ========================================
+        # WebSocket API Integrations
+        # ========================================
 
-        disconnect_route = apigwv2.CfnRoute(
-            self,
-            "DisconnectRoute",
-            api_id=self.websocket_api.ref,
-            route_key="$disconnect",
+        # $default route; the L2 integration also grants API Gateway invoke on the function.
+        # $connect/$disconnect need no backend, so they are left unrouted.
+        self.websocket_api.add_route(
+            "$default",
+            integration=apigwv2_integrations.WebSocketLambdaIntegration(
+                "TriggerStepIntegration",
+                self.trigger_step,
+            ),
         )
 
         # ========================================
@@ -600,7 +705,7 @@ class RiftTriviaStack(Stack):
         CfnOutput(
             self,
             "WebSocketURL",
-            value=f"wss://{self.websocket_api.ref}.execute-api.{self.region}.amazonaws.com/production",
+            value=self.websocket_stage.url,
             description="WebSocket API endpoint",
             export_name="RiftTrivia-WebSocketURL",
         )
@@ -620,6 +725,14 @@ class RiftTriviaStack(Stack):
             export_name="RiftTrivia-StateMachineArn",
         )
 
+        CfnOutput(
+            self,
+            "FastStateMachineArn",
+            value=self.fast_state_machine.state_machine_arn,
+            description="Step Functions EXPRESS state machine ARN for cached facts",
+            export_name="RiftTrivia-FastStateMachineArn",
+        )
+
         CfnOutput(
             self,
             "CallRiotApiArn",
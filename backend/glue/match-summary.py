@@ -6,30 +6,64 @@ transforming it into aggregated statistics and summaries stored in S3.
 """
 
 import argparse
-import json
 import os
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
 from typing import Dict, List, Any, Optional, Tuple
 
 import boto3
+import orjson
 import requests
-from pyspark.sql import SparkSession, DataFrame
+from requests.adapters import HTTPAdapter
+from pyspark.sql import SparkSession, DataFrame, Column
 from pyspark.sql.functions import (
-    col, explode, sum as _sum, avg, max as _max, min as _min, count as _count,
+    col, explode, avg, count as _count,
     when, collect_list, from_unixtime, to_timestamp,
-    month, hour, dayofweek, lag, udf, desc, row_number, struct, array
+    month, hour, dayofweek, struct, array,
+    create_map, lit, coalesce, broadcast, max_by,
+    sort_array, slice as _slice, transform
 )
-from pyspark.sql.window import Window
-from pyspark.sql.types import StringType
+from pyspark.sql.types import (
+    StructType, StructField, LongType, StringType, BooleanType, ArrayType
+)
+from pyspark.storagelevel import StorageLevel
 
 # Get environment variables
 import os
 
 S3_BUCKET = os.environ['S3_BUCKET']
 
+# Shared HTTP session so the Data Dragon / static-data requests reuse connections
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=5))
+
+# Only the per-match fields written by retrieve_match_data that this job reads.
+# Supplying it up front skips Spark's schema-inference pass over the whole prefix.
+MATCH_SCHEMA = StructType([
+    StructField("gameCreation", LongType()),
+    StructField("gameDuration", LongType()),
+    StructField("queueId", LongType()),
+    StructField("championName", StringType()),
+    StructField("teamPosition", StringType()),
+    StructField("kills", LongType()),
+    StructField("deaths", LongType()),
+    StructField("assists", LongType()),
+    StructField("totalMinionsKilled", LongType()),
+    StructField("neutralMinionsKilled", LongType()),
+    StructField("goldEarned", LongType()),
+    StructField("totalDamageDealtToChampions", LongType()),
+    StructField("totalDamageTaken", LongType()),
+    StructField("visionScore", LongType()),
+    StructField("win", BooleanType()),
+    StructField("items", ArrayType(LongType())),
+    StructField("summoner1Id", LongType()),
+    StructField("summoner2Id", LongType()),
+    StructField("perks", StructType([
+        StructField("primaryStyle", LongType()),
+        StructField("subStyle", LongType()),
+    ])),
+])
 
-def fetch_ddragon_data(url):
-    return requests.get(url).json()
 
 
 def parse_arguments() -> argparse.Namespace:
@@ -50,7 +84,7 @@ def initialize_spark() -> SparkSession:
 def fetch_ddragon_data(url: str) -> Dict:
     """Fetch data from Riot's Data Dragon API."""
     try:
-        response = requests.get(url)
+        response = http_session.get(url)
         response.raise_for_status()
         return response.json()
     except requests.RequestException as e:
@@ -63,43 +97,35 @@ def load_game_data(year: int) -> Dict:
     latest_patch = f"{base_version}.24.1"
     first_patch = f"{base_version}.1.1"
 
-    # Load item data from both patches
-    item_data_latest = fetch_ddragon_data(
-        f"https://ddragon.leagueoflegends.com/cdn/{latest_patch}/data/en_US/item.json"
-    )["data"]
-    item_data_old = fetch_ddragon_data(
-        f"https://ddragon.leagueoflegends.com/cdn/{first_patch}/data/en_US/item.json"
-    )["data"]
-
-    # Load spell and rune data
-    spell_data = fetch_ddragon_data(
-        f"https://ddragon.leagueoflegends.com/cdn/{latest_patch}/data/en_US/summoner.json"
-    )["data"]
-    rune_data = fetch_ddragon_data(
-        f"https://ddragon.leagueoflegends.com/cdn/{latest_patch}/data/en_US/runesReforged.json"
-    )
-    
-    queues = fetch_ddragon_data(
-        "https://static.developer.riotgames.com/docs/lol/queues.json"
-    )
-    
-    queue_map = {}
-    for q in queues:
-        qid = q.get("queueId")
-        map_name = q.get("map")
-        desc = q.get("description")
-        notes = q.get("notes")
-    
-        if desc is None and notes is None:
-            formatted = f"{map_name}"
-        elif desc is not None and notes is None:
-            formatted = f"{map_name}: {desc}"
-        elif desc is None and notes is not None:
-            formatted = f"{map_name} ({notes})"
-        else:
-            formatted = f"{map_name}: {desc} ({notes})"
-    
-        queue_map[qid] = formatted
+    ddragon_base = "https://ddragon.leagueoflegends.com/cdn"
+    urls = {
+        "items_latest": f"{ddragon_base}/{latest_patch}/data/en_US/item.json",
+        "items_old": f"{ddragon_base}/{first_patch}/data/en_US/item.json",
+        "spells": f"{ddragon_base}/{latest_patch}/data/en_US/summoner.json",
+        "runes": f"{ddragon_base}/{latest_patch}/data/en_US/runesReforged.json",
+        "queues": "https://static.developer.riotgames.com/docs/lol/queues.json",
+    }
+
+    # Fetch all static data concurrently
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        results = dict(zip(urls, executor.map(fetch_ddragon_data, urls.values())))
+
+    # Item data from both patches, spell, rune and queue data
+    item_data_latest = results["items_latest"]["data"]
+    item_data_old = results["items_old"]["data"]
+    spell_data = results["spells"]["data"]
+    rune_data = results["runes"]
+    queues = results["queues"]
+
+    # "<map>[: <description>][ (<notes>)]"
+    queue_map = {
+        q.get("queueId"): (
+            f'{q.get("map")}'
+            f'{": " + q["description"] if q.get("description") else ""}'
+            f'{" (" + q["notes"] + ")" if q.get("notes") else ""}'
+        )
+        for q in queues
+    }
 
     return {
         "items": {
@@ -112,85 +138,103 @@ def load_game_data(year: int) -> Dict:
     }
 
 
-def create_mapping_udfs(game_data: Dict) -> Dict:
-    """Create UDFs for mapping game data IDs to names."""
-    def map_item(item_id: int) -> str:
-        return (game_data["items"]["latest"].get(int(item_id)) or
-                game_data["items"]["old"].get(int(item_id)) or
-                str(item_id))
+def _literal_map(mapping: Dict[int, str]) -> Column:
+    """Build a literal map column from a Python dict."""
+    return create_map(*[lit(x) for pair in mapping.items() for x in pair])
 
-    def map_rune(rune_id: int) -> str:
-        return game_data["runes"].get(int(rune_id), str(rune_id))
 
-    def map_spell(spell_id: int) -> str:
-        return game_data["spells"].get(int(spell_id), str(spell_id))
-        
-    def map_mode(queue_id: int) -> str:
-        return game_data["modes"].get(int(queue_id), str(queue_id))
+def create_mapping_exprs(game_data: Dict) -> Dict:
+    """Create column expressions for mapping game data IDs to names.
+
+    Lookups are native map accesses evaluated in the JVM, so no rows are
+    shipped to Python workers.
+    """
+    items_latest = _literal_map(game_data["items"]["latest"])
+    items_old = _literal_map(game_data["items"]["old"])
+    runes = _literal_map(game_data["runes"])
+    spells = _literal_map(game_data["spells"])
+    modes = _literal_map(game_data["modes"])
+
+    def map_item(item_id: Column) -> Column:
+        key = item_id.cast("int")
+        return coalesce(items_latest[key], items_old[key], item_id.cast("string"))
+
+    def map_rune(rune_id: Column) -> Column:
+        return coalesce(runes[rune_id.cast("int")], rune_id.cast("string"))
+
+    def map_spell(spell_id: Column) -> Column:
+        return coalesce(spells[spell_id.cast("int")], spell_id.cast("string"))
+
+    def map_mode(queue_id: Column) -> Column:
+        return coalesce(modes[queue_id.cast("int")], queue_id.cast("string"))
 
     return {
-        "item": udf(map_item, StringType()),
-        "rune": udf(map_rune, StringType()),
-        "spell": udf(map_spell, StringType()),
-        "mode": udf(map_mode, StringType())
+        "item": map_item,
+        "rune": map_rune,
+        "spell": map_spell,
+        "mode": map_mode
     }
 
 
-def process_match_data(df: DataFrame, mapping_udfs: Dict) -> DataFrame:
+def win_rate() -> Column:
+    """Share of games won, averaging the boolean win flag cast to 0/1."""
+    return avg(col("win").cast("tinyint")).alias("winRate")
+
+
+def process_match_data(df: DataFrame, mapping_exprs: Dict) -> DataFrame:
     """Process raw match data with feature engineering."""
     return (df
             .withColumn("gameDate", to_timestamp(from_unixtime(col("gameCreation") / 1000)))
             .withColumn("month", month("gameDate"))
             .withColumn("hour", hour("gameDate"))
             .withColumn("dayOfWeek", dayofweek("gameDate"))
+            .withColumn("durationMin", col("gameDuration") / 60)
             .withColumn("csPerMin",
                         (col("totalMinionsKilled") + col("neutralMinionsKilled")) /
-                        (col("gameDuration") / 60))
+                        col("durationMin"))
             .withColumn("kda",
                         (col("kills") + col("assists")) /
                         when(col("deaths") == 0, 1).otherwise(col("deaths")))
             .withColumn("dmgPerMin",
-                        col("totalDamageDealtToChampions") / (col("gameDuration") / 60))
+                        col("totalDamageDealtToChampions") / col("durationMin"))
             .withColumn("dmgTakenPerMin",
-                        col("totalDamageTaken") / (col("gameDuration") / 60))
-            .withColumn("hoursPlayed", col("gameDuration") / 3600)
-            .withColumn("gameMode", mapping_udfs["mode"](col("queueId"))))
+                        col("totalDamageTaken") / col("durationMin"))
+            .withColumn("hoursPlayed", col("durationMin") / 60)
+            .withColumn("gameMode", mapping_exprs["mode"](col("queueId"))))
 
 
-def create_champion_summary(df: DataFrame, mapping_udfs: Dict) -> DataFrame:
+def create_champion_summary(df: DataFrame, mapping_exprs: Dict) -> DataFrame:
     """Create champion-level summary statistics."""
-    window_best_kda = Window.partitionBy(
-        "championName", "gameMode").orderBy(desc("kda"))
-
-    # Find best games per champion
+    # Find best games per champion (highest-KDA game per champion/mode)
     best_games = (df
-                  .withColumn("rank", row_number().over(window_best_kda))
-                  .filter(col("rank") == 1)
-                  .select(
-                      "championName",
-                      "kills", "deaths", "assists", "kda", "win",
-                      "gameDate", "gameMode",
-                      col("perks.primaryStyle").alias("primaryRuneId"),
-                      col("perks.subStyle").alias("secondaryRuneId"),
-                      col("summoner1Id").alias("spell1Id"),
-                      col("summoner2Id").alias("spell2Id")
-                  )
-                  .withColumn("primaryRune", mapping_udfs["rune"](col("primaryRuneId")))
-                  .withColumn("secondaryRune", mapping_udfs["rune"](col("secondaryRuneId")))
-                  .withColumn("summonerSpell1", mapping_udfs["spell"](col("spell1Id")))
-                  .withColumn("summonerSpell2", mapping_udfs["spell"](col("spell2Id"))))
+                  .groupBy("championName", "gameMode")
+                  .agg(max_by(
+                      struct(
+                          "kills", "deaths", "assists", "kda", "win", "gameDate",
+                          col("perks.primaryStyle").alias("primaryRuneId"),
+                          col("perks.subStyle").alias("secondaryRuneId"),
+                          col("summoner1Id").alias("spell1Id"),
+                          col("summoner2Id").alias("spell2Id")
+                      ),
+                      "kda"
+                  ).alias("best"))
+                  .select("championName", "gameMode", "best.*")
+                  .withColumn("primaryRune", mapping_exprs["rune"](col("primaryRuneId")))
+                  .withColumn("secondaryRune", mapping_exprs["rune"](col("secondaryRuneId")))
+                  .withColumn("summonerSpell1", mapping_exprs["spell"](col("spell1Id")))
+                  .withColumn("summonerSpell2", mapping_exprs["spell"](col("spell2Id"))))
 
     # Aggregate champion statistics
     champ_stats = df.groupBy("championName", "gameMode").agg(
         _count("*").alias("gamesPlayed"),
-        avg(when(col("win") == True, 1).otherwise(0)).alias("winRate"),
+        win_rate(),
         avg("kda").alias("avgKDA"),
         avg("csPerMin").alias("avgCSperMin")
     )
 
-    # Combine statistics with best games
+    # Combine statistics with best games (one row per champion/mode, so broadcast it)
     return (champ_stats
-            .join(best_games, on=["championName", "gameMode"], how="left")
+            .join(broadcast(best_games), on=["championName", "gameMode"], how="left")
             .select(
                 "championName",
                 "gameMode",
@@ -207,7 +251,7 @@ def create_champion_summary(df: DataFrame, mapping_udfs: Dict) -> DataFrame:
             ))
 
 
-def create_item_summary(df: DataFrame, mapping_udfs: Dict) -> DataFrame:
+def create_item_summary(df: DataFrame, mapping_exprs: Dict) -> DataFrame:
     """Create item-level summary statistics."""
     items = (df
              .select(
@@ -223,15 +267,14 @@ def create_item_summary(df: DataFrame, mapping_udfs: Dict) -> DataFrame:
                   .groupBy("itemId", "gameMode")
                   .agg(
                       _count("*").alias("usageCount"),
-                      avg(when(col("win") == True, 1).otherwise(
-                          0)).alias("winRate"),
+                      win_rate(),
                       avg("kda").alias("avgKDA"),
                       avg("goldEarned").alias("avgGoldEarned"),
                       avg("visionScore").alias("avgVisionScore"),
                       avg("dmgPerMin").alias("avgDamagePerMin"),
                       avg("dmgTakenPerMin").alias("avgDamageTakenPerMin")
                   )
-                  .withColumn("itemName", mapping_udfs["item"](col("itemId"))))
+                  .withColumn("itemName", mapping_exprs["item"](col("itemId"))))
 
     # Group statistics by item
     return (item_stats
@@ -245,7 +288,19 @@ def create_item_summary(df: DataFrame, mapping_udfs: Dict) -> DataFrame:
             ).alias("modes")))
 
 
-def create_spell_summary(df: DataFrame, mapping_udfs: Dict) -> DataFrame:
+def top_champions(usage: DataFrame, keys: List[str], k: int = 5) -> DataFrame:
+    """Keep the k most played champions per key as a champions array."""
+    ranked = sort_array(collect_list(struct("gamesPlayed", "championName")), asc=False)
+    return (usage
+            .groupBy(*keys)
+            .agg(_slice(ranked, 1, k).alias("champions"))
+            .withColumn("champions", transform("champions", lambda c: struct(
+                c["championName"].alias("championName"),
+                c["gamesPlayed"].alias("gamesPlayed")
+            ))))
+
+
+def create_spell_summary(df: DataFrame, mapping_exprs: Dict) -> DataFrame:
     """Create summoner spell combo summary statistics."""
     spells = df.select(
         "gameMode", "championName",
@@ -259,34 +314,23 @@ def create_spell_summary(df: DataFrame, mapping_udfs: Dict) -> DataFrame:
                    .groupBy("spell1Id", "spell2Id", "gameMode")
                    .agg(
                        _count("*").alias("comboCount"),
-                       avg(when(col("win") == True, 1).otherwise(
-                           0)).alias("winRate"),
+                       win_rate(),
                        avg("kda").alias("avgKDA")
                    ))
 
     # Find top champions for each spell combo
-    champ_usage = (spells
-                   .groupBy("spell1Id", "spell2Id", "gameMode", "championName")
-                   .agg(_count("*").alias("gamesPlayed"))
-                   .withColumn(
-                       "rank",
-                       row_number().over(
-                           Window.partitionBy(
-                               "spell1Id", "spell2Id", "gameMode")
-                           .orderBy(desc("gamesPlayed"))
-                       )
-                   )
-                   .filter(col("rank") <= 5)
-                   .groupBy("spell1Id", "spell2Id", "gameMode")
-                   .agg(collect_list(
-                       struct("championName", "gamesPlayed")
-                   ).alias("champions")))
+    champ_usage = top_champions(
+        spells
+        .groupBy("spell1Id", "spell2Id", "gameMode", "championName")
+        .agg(_count("*").alias("gamesPlayed")),
+        ["spell1Id", "spell2Id", "gameMode"]
+    )
 
-    # Combine stats and map IDs to names
+    # Combine stats (broadcasting the small top-champion side) and map IDs to names
     return (spell_stats
-            .join(champ_usage, on=["spell1Id", "spell2Id", "gameMode"], how="left")
-            .withColumn("spell1Name", mapping_udfs["spell"](col("spell1Id")))
-            .withColumn("spell2Name", mapping_udfs["spell"](col("spell2Id")))
+            .join(broadcast(champ_usage), on=["spell1Id", "spell2Id", "gameMode"], how="left")
+            .withColumn("spell1Name", mapping_exprs["spell"](col("spell1Id")))
+            .withColumn("spell2Name", mapping_exprs["spell"](col("spell2Id")))
             .groupBy("spell1Name", "spell2Name")
             .agg(collect_list(
                 struct(
@@ -296,7 +340,7 @@ def create_spell_summary(df: DataFrame, mapping_udfs: Dict) -> DataFrame:
             ).alias("modes")))
 
 
-def create_rune_summary(df: DataFrame, mapping_udfs: Dict) -> DataFrame:
+def create_rune_summary(df: DataFrame, mapping_exprs: Dict) -> DataFrame:
     """Create rune style combo summary statistics."""
     runes = df.select(
         "gameMode", "championName",
@@ -310,34 +354,23 @@ def create_rune_summary(df: DataFrame, mapping_udfs: Dict) -> DataFrame:
                   .groupBy("primaryStyleId", "subStyleId", "gameMode")
                   .agg(
                       _count("*").alias("comboCount"),
-                      avg(when(col("win") == True, 1).otherwise(
-                          0)).alias("winRate"),
+                      win_rate(),
                       avg("kda").alias("avgKDA")
                   ))
 
     # Find top champions for each rune combo
-    champ_usage = (runes
-                   .groupBy("primaryStyleId", "subStyleId", "gameMode", "championName")
-                   .agg(_count("*").alias("gamesPlayed"))
-                   .withColumn(
-                       "rank",
-                       row_number().over(
-                           Window.partitionBy(
-                               "primaryStyleId", "subStyleId", "gameMode")
-                           .orderBy(desc("gamesPlayed"))
-                       )
-                   )
-                   .filter(col("rank") <= 5)
-                   .groupBy("primaryStyleId", "subStyleId", "gameMode")
-                   .agg(collect_list(
-                       struct("championName", "gamesPlayed")
-                   ).alias("champions")))
-
-    # Combine stats and map IDs to names
+    champ_usage = top_champions(
+        runes
+        .groupBy("primaryStyleId", "subStyleId", "gameMode", "championName")
+        .agg(_count("*").alias("gamesPlayed")),
+        ["primaryStyleId", "subStyleId", "gameMode"]
+    )
+
+    # Combine stats (broadcasting the small top-champion side) and map IDs to names
     return (rune_stats
-            .join(champ_usage, on=["primaryStyleId", "subStyleId", "gameMode"], how="left")
-            .withColumn("primaryStyle", mapping_udfs["rune"](col("primaryStyleId")))
-            .withColumn("subStyle", mapping_udfs["rune"](col("subStyleId")))
+            .join(broadcast(champ_usage), on=["primaryStyleId", "subStyleId", "gameMode"], how="left")
+            .withColumn("primaryStyle", mapping_exprs["rune"](col("primaryStyleId")))
+            .withColumn("subStyle", mapping_exprs["rune"](col("subStyleId")))
             .groupBy("primaryStyle", "subStyle")
             .agg(collect_list(
                 struct(
@@ -347,15 +380,51 @@ def create_rune_summary(df: DataFrame, mapping_udfs: Dict) -> DataFrame:
             ).alias("modes")))
 
 
-def create_role_summary(df: DataFrame) -> DataFrame:
+# grouping_id(teamPosition, hour, month, gameMode) of each grouping set below
+ROLE_MODE_SET = 0b0110
+HOUR_MODE_SET = 0b1010
+MONTH_MODE_SET = 0b1100
+MODE_SET = 0b1110
+OVERALL_SET = 0b1111
+
+
+def create_breakdowns(df: DataFrame) -> DataFrame:
+    """Aggregate role, hour, month, per-mode and overall statistics together.
+
+    A single GROUPING SETS aggregation shares one shuffle of the match data;
+    the small result is cached and split into the individual summaries.
+    """
+    df.createOrReplaceTempView("matches")
+    return df.sparkSession.sql("""
+        SELECT
+            teamPosition, hour, month, gameMode,
+            grouping_id(teamPosition, hour, month, gameMode) AS groupingSet,
+            count(*) AS gamesPlayed,
+            sum(CAST(win AS INT)) AS totalWins,
+            avg(CAST(win AS TINYINT)) AS winRate,
+            sum(hoursPlayed) AS totalHoursPlayed,
+            avg(kda) AS avgKDA,
+            avg(csPerMin) AS avgCSperMin,
+            avg(dmgPerMin) AS avgDamagePerMin,
+            avg(dmgTakenPerMin) AS avgDamageTakenPerMin,
+            avg(gameDuration) AS avgGameDuration,
+            max(goldEarned) AS highestGold,
+            max(visionScore) AS highestVision
+        FROM matches
+        GROUP BY teamPosition, hour, month, gameMode GROUPING SETS (
+            (teamPosition, gameMode),
+            (hour, gameMode),
+            (month, gameMode),
+            (gameMode),
+            ()
+        )
+    """).cache()
+
+
+def create_role_summary(breakdowns: DataFrame) -> DataFrame:
     """Create role-based summary statistics."""
-    return (df
-            .groupBy("teamPosition", "gameMode")
-            .agg(
-                _count("*").alias("gamesPlayed"),
-                avg(when(col("win") == True, 1).otherwise(0)).alias("winRate"),
-                avg("kda").alias("avgKDA")
-            )
+    return (breakdowns
+            .filter(col("groupingSet") == ROLE_MODE_SET)
             .groupBy("teamPosition")
             .agg(collect_list(
                 struct(
@@ -364,21 +433,19 @@ def create_role_summary(df: DataFrame) -> DataFrame:
             ).alias("modes")))
 
 
-def create_time_summaries(df: DataFrame) -> tuple:
+def create_time_summaries(breakdowns: DataFrame) -> tuple:
     """Create time-based summary statistics."""
     # Hourly summary
-    hour_summary = (df
-                    .groupBy("hour", "gameMode")
-                    .agg(_count("*").alias("gamesPlayed"))
+    hour_summary = (breakdowns
+                    .filter(col("groupingSet") == HOUR_MODE_SET)
                     .groupBy("hour")
                     .agg(collect_list(
                         struct("gameMode", "gamesPlayed")
                     ).alias("modes")))
 
     # Monthly summary
-    month_summary = (df
-                     .groupBy("month", "gameMode")
-                     .agg(_count("*").alias("gamesPlayed"))
+    month_summary = (breakdowns
+                     .filter(col("groupingSet") == MONTH_MODE_SET)
                      .groupBy("month")
                      .agg(collect_list(
                          struct("gameMode", "gamesPlayed")
@@ -388,76 +455,64 @@ def create_time_summaries(df: DataFrame) -> tuple:
 
 
 def analyze_streaks(df: DataFrame) -> Tuple[Dict, Dict]:
-    """Analyze win/lose streaks."""
-    window_spec = Window.orderBy("gameDate")
-
-    streak_df = (df
-                 .withColumn("prevWin", lag("win", 1).over(window_spec))
-                 .withColumn(
-                     "streakChange",
-                     when(col("win") != col("prevWin"), 1).otherwise(0)
-                 )
-                 .withColumn("streakGroup", _sum("streakChange").over(window_spec)))
-
-    streaks = (streak_df
-               .groupBy("streakGroup")
-               .agg(
-                   _count("*").alias("streakLength"),
-                   _max("win").alias("isWinStreak"),
-                   _min("gameDate").alias("startDate"),
-                   _max("gameDate").alias("endDate")
-               ))
-
-    # Find longest win streak
-    win_streak = (streaks
-                  .filter(col("isWinStreak") == True)
-                  .orderBy(desc("streakLength"))
-                  .limit(1)
-                  .collect())
-
-    # Find longest lose streak
-    lose_streak = (streaks
-                   .filter(col("isWinStreak") == False)
-                   .orderBy(desc("streakLength"))
-                   .limit(1)
-                   .collect())
-
-    def format_streak(streak_row: List) -> Dict:
-        if not streak_row:
-            return {"length": 0, "startDate": None, "endDate": None}
-        return {
-            "length": streak_row[0]["streakLength"],
-            "startDate": streak_row[0]["startDate"],
-            "endDate": streak_row[0]["endDate"]
-        }
+    """Analyze win/lose streaks.
 
-    return format_streak(win_streak), format_streak(lose_streak)
+    One player's games for a year are few enough to scan in order on the
+    driver, which avoids an unpartitioned window over the whole dataset.
+    """
+    games = df.select("gameDate", "win").orderBy("gameDate").collect()
+
+    longest = {
+        True: {"length": 0, "startDate": None, "endDate": None},
+        False: {"length": 0, "startDate": None, "endDate": None}
+    }
+    for is_win, run in groupby(games, key=lambda row: row["win"]):
+        run = list(run)
+        if is_win in longest and len(run) > longest[is_win]["length"]:
+            longest[is_win] = {
+                "length": len(run),
+                "startDate": run[0]["gameDate"],
+                "endDate": run[-1]["gameDate"]
+            }
+
+    return longest[True], longest[False]
 
 
-def create_global_summary(df: DataFrame) -> Dict:
+def to_records(df: DataFrame) -> List[Dict]:
+    """Collect a small result DataFrame into a list of plain dicts."""
+    return [row.asDict(recursive=True) for row in df.collect()]
+
+
+def create_global_summary(breakdowns: DataFrame) -> Dict:
     """Create global summary statistics."""
     # Overall statistics
-    global_stats = df.agg(
-        _count("*").alias("totalGames"),
-        _sum(when(col("win") == True, 1).otherwise(0)).alias("totalWins"),
-        _sum("hoursPlayed").alias("totalHoursPlayed")
-    ).withColumn("winRate", col("totalWins") / col("totalGames"))
+    overall = breakdowns.filter(col("groupingSet") == OVERALL_SET).first()
+    if overall is None or not overall["gamesPlayed"]:
+        # GROUPING SETS emits no grand-total row for empty input; keep the zeroed
+        # shape df.agg() used to return (sums and the ratio are null for no games)
+        global_data = {
+            "totalGames": 0,
+            "totalWins": None,
+            "totalHoursPlayed": None,
+            "winRate": None
+        }
+    else:
+        global_data = {
+            "totalGames": overall["gamesPlayed"],
+            "totalWins": overall["totalWins"],
+            "totalHoursPlayed": overall["totalHoursPlayed"],
+            "winRate": overall["totalWins"] / overall["gamesPlayed"]
+        }
 
     # Per-mode statistics
-    mode_stats = df.groupBy("gameMode").agg(
-        _count("*").alias("gamesPlayed"),
-        avg(when(col("win") == True, 1).otherwise(0)).alias("winRate"),
-        avg("kda").alias("avgKDA"),
-        avg("csPerMin").alias("avgCSperMin"),
-        avg("dmgPerMin").alias("avgDamagePerMin"),
-        avg("dmgTakenPerMin").alias("avgDamageTakenPerMin"),
-        avg("gameDuration").alias("avgGameDuration"),
-        _max("goldEarned").alias("highestGold"),
-        _max("visionScore").alias("highestVision")
-    )
-
-    global_data = global_stats.toPandas().to_dict(orient="records")[0]
-    global_data["modes"] = mode_stats.toPandas().to_dict(orient="records")
+    mode_stats = (breakdowns
+                  .filter(col("groupingSet") == MODE_SET)
+                  .select(
+                      "gameMode", "gamesPlayed", "winRate", "avgKDA",
+                      "avgCSperMin", "avgDamagePerMin", "avgDamageTakenPerMin",
+                      "avgGameDuration", "highestGold", "highestVision"
+                  ))
+    global_data["modes"] = to_records(mode_stats)
 
     return global_data
 
@@ -466,38 +521,37 @@ def save_to_s3(data: Dict, puuid: str, year: int, bucket: str, prefix: str) -> N
     """Save processed data and metadata to S3."""
     s3 = boto3.client("s3")
 
-    class DateTimeEncoder(json.JSONEncoder):
-        def default(self, obj):
-            if isinstance(obj, datetime):
-                return obj.isoformat()
-            return super().default(obj)
-
     data_key = f"{prefix}/final_summary_{year}.json"
     metadata_key = f"{data_key}.metadata.json"
 
-    try:
-        # Save data file
-        s3.put_object(
-            Bucket=bucket,
-            Key=data_key,
-            Body=json.dumps(data, cls=DateTimeEncoder),
-            ContentType="application/json"
-        )
-        
-        # Save metadata file
-        metadata = {
-            "metadataAttributes": {
-                "puuid": puuid,
-                "year": year
-            }
+    # Written uncompressed: the Bedrock KB data source ingests these objects as-is
+    # and does not honour Content-Encoding, so a gzip body would not be parsed.
+    # orjson emits compact output and serialises datetimes natively; the two PUTs
+    # run in parallel.
+    metadata = {
+        "metadataAttributes": {
+            "puuid": puuid,
+            "year": year
         }
+    }
+    objects = {
+        # OPT_NON_STR_KEYS keeps json.dumps' behaviour of stringifying int keys
+        data_key: orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS),
+        metadata_key: orjson.dumps(metadata),
+    }
+
+    def put(key: str) -> None:
         s3.put_object(
             Bucket=bucket,
-            Key=metadata_key,
-            Body=json.dumps(metadata),
+            Key=key,
+            Body=objects[key],
             ContentType="application/json"
         )
-        
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(objects)) as executor:
+            list(executor.map(put, objects))
+
         print(f"✅ Player summary and metadata written to s3://{bucket}/{data_key}[.metadata.json]")
     except Exception as e:
         raise Exception(f"Failed to save data to S3: {e}")
@@ -513,23 +567,29 @@ def main():
     # Initialize Spark and load game data
     spark = initialize_spark()
     game_data = load_game_data(args.year)
-    mapping_udfs = create_mapping_udfs(game_data)
+    mapping_exprs = create_mapping_exprs(game_data)
 
     try:
         # Read and process match data
-        df = spark.read.option("recursiveFileLookup", "true").option(
-            "multiLine", "true").json(s3_input)
-        processed_df = process_match_data(df, mapping_udfs)
+        # Per-match single-line JSON files and daily .jsonl.gz rollups are both JSON Lines,
+        # so the line-based reader handles them (gzip is decoded from the extension)
+        df = (spark.read
+              .schema(MATCH_SCHEMA)
+              .option("recursiveFileLookup", "true")
+              .json(s3_input))
+        # Every summary below scans this frame; keep it instead of re-reading S3 each time
+        processed_df = process_match_data(df, mapping_exprs).persist(StorageLevel.MEMORY_AND_DISK)
 
         # Generate summaries
-        champ_summary = create_champion_summary(processed_df, mapping_udfs)
-        item_summary = create_item_summary(processed_df, mapping_udfs)
-        spell_summary = create_spell_summary(processed_df, mapping_udfs)
-        rune_summary = create_rune_summary(processed_df, mapping_udfs)
-        role_summary = create_role_summary(processed_df)
-        time_summary, month_summary = create_time_summaries(processed_df)
+        champ_summary = create_champion_summary(processed_df, mapping_exprs)
+        item_summary = create_item_summary(processed_df, mapping_exprs)
+        spell_summary = create_spell_summary(processed_df, mapping_exprs)
+        rune_summary = create_rune_summary(processed_df, mapping_exprs)
+        breakdowns = create_breakdowns(processed_df)
+        role_summary = create_role_summary(breakdowns)
+        time_summary, month_summary = create_time_summaries(breakdowns)
         win_streak, lose_streak = analyze_streaks(processed_df)
-        global_summary = create_global_summary(processed_df)
+        global_summary = create_global_summary(breakdowns)
 
         # Add streak information
         global_summary["longestWinStreak"] = win_streak
@@ -540,19 +600,21 @@ def main():
             "playerPUUID": args.puuid,
             "summary": {
                 "global": global_summary,
-                "champions": champ_summary.toPandas().to_dict(orient="records"),
-                "roles": role_summary.toPandas().to_dict(orient="records"),
-                "items": item_summary.toPandas().to_dict(orient="records"),
-                "spells": spell_summary.toPandas().to_dict(orient="records"),
-                "runes": rune_summary.toPandas().to_dict(orient="records"),
-                "activityByHour": time_summary.toPandas().to_dict(orient="records"),
-                "activityByMonth": month_summary.toPandas().to_dict(orient="records")
+                "champions": to_records(champ_summary),
+                "roles": to_records(role_summary),
+                "items": to_records(item_summary),
+                "spells": to_records(spell_summary),
+                "runes": to_records(rune_summary),
+                "activityByHour": to_records(time_summary),
+                "activityByMonth": to_records(month_summary)
             }
         }
 
         # Save results
         save_to_s3(final_data, args.puuid, args.year,
                    S3_BUCKET, s3_output_prefix)
+        breakdowns.unpersist()
+        processed_df.unpersist()
 
     except Exception as e:
         print(f"❌ Error processing match data: {e}")
@@ -1,27 +1,36 @@
+import base64
+import gzip
 import json
-import time
 import boto3
 import urllib3
 import os
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote
 from datetime import datetime, timezone
+from riot_api_key import get_api_key
+from sdk_config import pooled_config
 
 BUCKET = os.environ['S3_BUCKET']
-SSM_PARAMETER_NAME = os.environ['RIOT_API_KEY_SSM_PARAM']
 
-s3 = boto3.client("s3")
+boto_config = pooled_config()
 
-# Get API key from Parameter Store
-ssm = boto3.client('ssm')
-parameter = ssm.get_parameter(
-    Name=SSM_PARAMETER_NAME,
-    WithDecryption=True
-)
-api_key = parameter['Parameter']['Value']
+s3 = boto3.client("s3", config=boto_config)
 
-# Initialize HTTP client
-http = urllib3.PoolManager()
-headers = {'X-Riot-Token': api_key}
+# Initialize HTTP client: keep-alive pools sized for the concurrent lookups, with short
+# bounded retries on transient 5xx errors. 429s are returned to the caller straight away:
+# a 2-minute-window Retry-After would outlast this function's timeout.
+http = urllib3.PoolManager(
+    maxsize=4,
+    block=False,
+    retries=urllib3.Retry(
+        total=2,
+        backoff_factor=0.1,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({'GET'}),
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+)
 
 def file_exists(key):
     try:
@@ -31,6 +40,27 @@ def file_exists(key):
         return False
 
 
+def build_response(event, status_code, payload):
+    """Build a JSON function URL response, gzip-compressed when the client accepts it."""
+    body = json.dumps(payload)
+    # Function URL events carry lower-cased header names
+    accept_encoding = (event.get('headers') or {}).get('accept-encoding', '')
+    if 'gzip' not in accept_encoding.lower():
+        return {
+            'statusCode': status_code,
+            'body': body
+        }
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip'
+        },
+        'isBase64Encoded': True,
+        'body': base64.b64encode(gzip.compress(body.encode('utf-8'))).decode('ascii')
+    }
+
+
 def lambda_handler(event, context):
     """
     Resolve Riot ID to PUUID and basic summoner info; check S3 for existing summary/final.
@@ -54,6 +84,8 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'Please use Riot ID format: GameName#TAG (e.g., Hide on bush#KR1)'})
             }
         
+        headers = {'X-Riot-Token': get_api_key()}
+
         # Step 1: Get account PUUID using Riot ID
         game_name, tag_line = riot_id.split('#', 1)
         game_name = quote(game_name)
@@ -77,28 +109,33 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': f'Failed to fetch account: {account_response.status}'})
             }
         
-        account_data = json.loads(account_response.data.decode('utf-8'))
+        account_data = json.loads(account_response.data)
         puuid = account_data['puuid']
         resolved_riot_id = f"{account_data['gameName']}#{account_data['tagLine']}"
         
-        # Step 2: Get summoner data by PUUID (platform region)
-        summoner_url = f"https://{region}.api.riotgames.com/lol/summoner/v4/summoners/by-puuid/{puuid}"
-        summoner_response = http.request('GET', summoner_url, headers=headers)
-        if summoner_response.status != 200:
-            return {
-                'statusCode': 500,
-                'body': json.dumps({'error': 'Failed to fetch summoner data'})
-            }
-        summoner_data = json.loads(summoner_response.data.decode('utf-8'))
-        
         # Last year
         current_year = datetime.now(timezone.utc).year
         last_year = current_year - 1
 
         summary_key = f"summary/{puuid}/final_summary_{last_year}.json"
         final_key = f"player_facts/{puuid}/{last_year}.json"
-        summary_exists = file_exists(summary_key)
-        final_exists = file_exists(final_key)
+
+        # Step 2: Get summoner data by PUUID (platform region), overlapped with the S3 checks
+        summoner_url = f"https://{region}.api.riotgames.com/lol/summoner/v4/summoners/by-puuid/{puuid}"
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            summoner_future = executor.submit(http.request, 'GET', summoner_url, headers=headers)
+            summary_future = executor.submit(file_exists, summary_key)
+            final_future = executor.submit(file_exists, final_key)
+
+        summoner_response = summoner_future.result()
+        if summoner_response.status != 200:
+            return {
+                'statusCode': 500,
+                'body': json.dumps({'error': 'Failed to fetch summoner data'})
+            }
+        summoner_data = json.loads(summoner_response.data)
+        summary_exists = summary_future.result()
+        final_exists = final_future.result()
 
         response_data = {
             'summoner': {
@@ -116,10 +153,7 @@ def lambda_handler(event, context):
             'final_exists': final_exists
         }
         
-        return {
-            'statusCode': 200,
-            'body': json.dumps(response_data)
-        }
+        return build_response(event, 200, response_data)
         
     except Exception as e:
         print(f"Error: {str(e)}")
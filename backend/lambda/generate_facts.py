@@ -1,7 +1,10 @@
+import gzip
 import json
 import re
 import boto3
 import os
+from sdk_config import pooled_config
+from websocket_sender import WebSocketSender
 
 BUCKET = os.environ['S3_BUCKET']
 KB_ID = os.environ['BEDROCK_KB_ID']
@@ -9,18 +12,25 @@ REGION = os.environ['AWS_REGION']
 MODEL_ID = os.environ['BEDROCK_MODEL_ID']
 API_GATEWAY_ENDPOINT = os.environ['API_GATEWAY_ENDPOINT']
 
-bedrock_client = boto3.client('bedrock-agent-runtime', region_name=REGION)
-s3 = boto3.client('s3')
-api = boto3.client('apigatewaymanagementapi', endpoint_url=API_GATEWAY_ENDPOINT)
+boto_config = pooled_config()
 
-def rag_generate(puuid: str, year: int, max_results: int = 15):
-    query = """
+bedrock_client = boto3.client('bedrock-agent-runtime', region_name=REGION, config=boto_config)
+s3 = boto3.client('s3', config=boto_config)
+api = boto3.client('apigatewaymanagementapi', endpoint_url=API_GATEWAY_ENDPOINT, config=boto_config)
+ws = WebSocketSender(api)
+
+# Last-resort match (first "[" to last "]") when no balanced array of objects is found
+JSON_ARRAY_RE = re.compile(r'\[.*\]', re.DOTALL)
+
+# Static instructions go in the generation prompt template (Bedrock substitutes the retrieved
+# chunks for $search_results$); only the short query below is embedded for retrieval
+FACTS_PROMPT_TEMPLATE = """
 You are an AI analyst and creative storyteller for League of Legends, combining the roles of:
 - A data analyst who understands player performance metrics (kills, assists, win rate, etc.).
 - A quiz master who creates fun and clever trivia about gameplay stats.
 - A storyteller who writes in a friendly, gamer-savvy tone — suitable for a year-in-review recap.
 Your task:
-1. Retrieve the player’s summary data from the knowledge base.
+1. Use the player’s summary data given in the search results below.
 2. Generate 10 unique, data-backed facts about their performance over the past year.
     - Each fact must be specific, numerically grounded, and clearly related to the player’s behavior or style.
 3. For each fact:
@@ -45,19 +55,35 @@ Return a JSON array with the following fields:
   }
 ]
 Output must be **a pure JSON array only**, without any extra text, markdown, or commentary.
-    """
+
+Search results:
+$search_results$
+"""
+
+FACTS_RETRIEVAL_QUERY = (
+    "League of Legends player year summary: champions, roles, items, runes, summoner spells, "
+    "game modes, activity by hour and month, win streaks and overall performance stats"
+)
+
+def rag_generate(puuid: str, year: int, max_results: int = 15):
     response = bedrock_client.retrieve_and_generate(
-        input={'text': query},
+        input={'text': FACTS_RETRIEVAL_QUERY},
         retrieveAndGenerateConfiguration={
             'type': 'KNOWLEDGE_BASE',
             'knowledgeBaseConfiguration': {
                 'knowledgeBaseId': KB_ID,
                 'modelArn': MODEL_ID,
+                'generationConfiguration': {
+                    'promptTemplate': {'textPromptTemplate': FACTS_PROMPT_TEMPLATE}
+                },
                 'retrievalConfiguration': {
                     'vectorSearchConfiguration': {
                         'numberOfResults': max_results,
+                        # puuid/year are filterable keys in the S3 Vectors index, so this is
+                        # applied during the vector search. year is numeric in the .metadata.json
+                        # files and 'equals' is type-sensitive, so pass it as an int.
                         'filter': {'andAll': [{'equals': {'key': 'puuid','value': puuid}},
-                            {'equals': {'key': 'year','value': year}}]}
+                            {'equals': {'key': 'year','value': int(year)}}]}
                     }
                 }
             }
@@ -66,19 +92,60 @@ Output must be **a pure JSON array only**, without any extra text, markdown, or
     answer = response.get('output', {}).get('text', '')
     return answer
 
+def balanced_array_at(text: str, start: int):
+    """Return the [...] slice opening at text[start], skipping brackets inside strings, or None."""
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '[':
+            depth += 1
+        elif ch == ']':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
 def extract_json_array(text: str):
     try:
         return json.loads(text)
     except json.JSONDecodeError:
-        match = re.search(r'\[.*\]', text, re.DOTALL)
-        if match:
-            json_str = match.group(0)
-            try:
-                return json.loads(json_str)
-            except json.JSONDecodeError:
-                raise ValueError("Found a JSON-like array but couldn't parse it.")
-        else:
-            raise ValueError("No JSON array found in text.")
+        pass
+
+    # Linear bracket scan for the first non-empty array of objects embedded in surrounding prose;
+    # a rejected candidate is skipped whole rather than rescanning the brackets nested inside it
+    start = text.find('[')
+    while start != -1:
+        candidate = balanced_array_at(text, start)
+        if candidate is None:
+            break
+        try:
+            parsed = json.loads(candidate)
+            if isinstance(parsed, list) and parsed and all(isinstance(item, dict) for item in parsed):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+        start = text.find('[', start + len(candidate))
+
+    match = JSON_ARRAY_RE.search(text)
+    if match:
+        json_str = match.group(0)
+        try:
+            return json.loads(json_str)
+        except json.JSONDecodeError:
+            raise ValueError("Found a JSON-like array but couldn't parse it.")
+    else:
+        raise ValueError("No JSON array found in text.")
 
 def lambda_handler(event, context):
     puuid = event['puuid']
@@ -86,19 +153,26 @@ def lambda_handler(event, context):
     final_exists = event['final_exists']
     connection_id = event['connectionId']
 
-    if final_exists:
-        final_output = json.loads(s3.get_object(Bucket=BUCKET, Key=f'player_facts/{puuid}/{year}.json')['Body'].read().decode('utf-8'))
-    else: 
-        if connection_id:
-            api.post_to_connection(
-                ConnectionId=connection_id,
-                Data=json.dumps({"state":"GENERATING_FACTS"})
+    try:
+        if final_exists:
+            obj = s3.get_object(Bucket=BUCKET, Key=f'player_facts/{puuid}/{year}.json')
+            raw = obj['Body'].read()
+            # Facts written before compression was introduced are plain JSON
+            final_output = json.loads(gzip.decompress(raw) if obj.get('ContentEncoding') == 'gzip' else raw)
+        else: 
+            # Posted in the background while the Bedrock call runs
+            ws.send(connection_id, json.dumps({"state":"GENERATING_FACTS"}))
+            final_output = extract_json_array(rag_generate(puuid, year))
+            s3.put_object(
+                Body=gzip.compress(json.dumps(final_output).encode('utf-8')),
+                Bucket=BUCKET,
+                Key=f'player_facts/{puuid}/{year}.json',
+                ContentType='application/json',
+                ContentEncoding='gzip'
             )
-        final_output = extract_json_array(rag_generate(puuid, year))
-        s3.put_object(Body=json.dumps(final_output), Bucket=BUCKET, Key=f'player_facts/{puuid}/{year}.json')
-    if connection_id:
-        api.post_to_connection(
-            ConnectionId=connection_id,
-            Data=json.dumps({"state":"COMPLETE","result":final_output})
-        )
+        ws.send(connection_id, json.dumps({"state":"COMPLETE","result":final_output}))
+    finally:
+        # Drain queued messages before the environment is frozen (and before a failure
+        # handler's message could overtake them)
+        ws.flush()
     return final_output
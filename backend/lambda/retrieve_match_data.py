@@ -1,27 +1,113 @@
+import gzip
 import json
+import threading
 import time
 import boto3
 import urllib3
 import os
-from urllib.parse import quote
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
+from riot_api_key import get_api_key
+from sdk_config import pooled_config
+from websocket_sender import WebSocketSender
+
+try:
+    # Provided by the optional orjson layer (orjson_layer_arn context key); stdlib json otherwise
+    import orjson
+except ImportError:
+    orjson = None
 
 BUCKET = os.environ['S3_BUCKET']
-SSM_PARAMETER_NAME = os.environ['RIOT_API_KEY_SSM_PARAM']
 API_GATEWAY_ENDPOINT = os.environ['API_GATEWAY_ENDPOINT']
 
-s3 = boto3.client("s3")
+# Riot personal key limits: 20 requests / 1 s and 100 requests / 2 min
+RIOT_RATE_LIMITS = ((20, 1), (100, 120))
+MAX_WORKERS = 20
+# Attempts per Riot request before giving up on 429 / 5xx responses
+MAX_RIOT_ATTEMPTS = 6
+
+# WebSocket progress updates are coalesced to at most one per N matches / interval
+PROGRESS_EVERY_MATCHES = 10
+PROGRESS_INTERVAL_SECONDS = 0.5
+
+# Fetched stats are merged into their daily rollup files in batches of this size
+ROLLUP_FLUSH_EVERY_MATCHES = 100
+
+# One pooled SDK connection per worker thread
+boto_config = pooled_config(max_pool_connections=MAX_WORKERS)
 
-ssm = boto3.client('ssm')
-parameter = ssm.get_parameter(
-    Name=SSM_PARAMETER_NAME,
-    WithDecryption=True
+s3 = boto3.client("s3", config=boto_config)
+
+# One pooled connection per worker thread. urllib3's own retries are off because
+# riot_get retries (and rate-limits) itself; timeouts keep a stalled socket from
+# holding a worker until the Lambda times out.
+http = urllib3.PoolManager(
+    num_pools=4,
+    maxsize=MAX_WORKERS,
+    block=False,
+    retries=False,
+    timeout=urllib3.Timeout(connect=2.0, read=10.0)
 )
-api_key = parameter['Parameter']['Value']
+api = boto3.client('apigatewaymanagementapi', endpoint_url=API_GATEWAY_ENDPOINT, config=boto_config)
+ws = WebSocketSender(api)
+
+class RateLimiter:
+    """Thread-safe sliding-window limiter enforcing several (max_calls, window_seconds) limits."""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.longest_window = max(window for _, window in limits)
+        self.calls = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.calls and now - self.calls[0] >= self.longest_window:
+                    self.calls.popleft()
+                wait = 0
+                for max_calls, window in self.limits:
+                    recent = [t for t in self.calls if now - t < window]
+                    if len(recent) >= max_calls:
+                        wait = max(wait, recent[-max_calls] + window - now)
+                if wait <= 0:
+                    self.calls.append(now)
+                    return
+            time.sleep(wait)
 
-http = urllib3.PoolManager()
-headers = {'X-Riot-Token': api_key}
-api = boto3.client('apigatewaymanagementapi', endpoint_url=API_GATEWAY_ENDPOINT)
+
+rate_limiter = RateLimiter(RIOT_RATE_LIMITS)
+
+def json_loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def json_dumps(obj):
+    return orjson.dumps(obj).decode('utf-8') if orjson else json.dumps(obj)
+
+def riot_get(url, fields=None):
+    """GET a Riot API URL, retrying 429s (per Retry-After) and 5xx / connection errors (exponential backoff)."""
+    for attempt in range(MAX_RIOT_ATTEMPTS):
+        rate_limiter.acquire()
+        try:
+            resp = http.request('GET', url, headers={'X-Riot-Token': get_api_key()}, fields=fields)
+        except urllib3.exceptions.HTTPError:
+            # Connection errors / timeouts back off like a 5xx
+            if attempt == MAX_RIOT_ATTEMPTS - 1:
+                raise
+            time.sleep(min(2 ** attempt, 8))
+            continue
+        if resp.status != 429 and resp.status < 500:
+            break
+        if attempt == MAX_RIOT_ATTEMPTS - 1:
+            # Out of attempts: hand the failed response back without waiting again
+            break
+        if resp.status == 429:
+            time.sleep(min(float(resp.headers.get("Retry-After", 1)), 5))
+        else:
+            time.sleep(min(2 ** attempt, 8))
+    return resp
 
 def fetch_match_ids(puuid, routing_value, start_time=None, end_time=None, start=0, count=100):
     url = f"https://{routing_value}.api.riotgames.com/lol/match/v5/matches/by-puuid/{puuid}/ids"
@@ -30,26 +116,57 @@ def fetch_match_ids(puuid, routing_value, start_time=None, end_time=None, start=
         params["startTime"] = start_time
     if end_time:
         params["endTime"] = end_time
-    resp = http.request('GET', url, headers=headers, fields=params)
-    if resp.status == 429:
-        time.sleep(2)
-        return fetch_match_ids(puuid, routing_value, start_time, end_time, start, count)
-    elif resp.status != 200:
+    resp = riot_get(url, fields=params)
+    if resp.status != 200:
         raise Exception(f"Failed to fetch match IDs: {resp.status}, {resp.data.decode('utf-8')}")
-    return json.loads(resp.data.decode('utf-8'))
+    return json_loads(resp.data)
+
+def iter_match_ids(puuid, routing_value, start_time, end_time, batch_size=100):
+    """Yield the player's match IDs in the time range, one page of batch_size at a time."""
+    start = 0
+    while True:
+        batch = fetch_match_ids(
+            puuid,
+            routing_value,
+            start_time=start_time,
+            end_time=end_time,
+            start=start,
+            count=batch_size
+        )
+        if not batch:
+            return
+        yield from batch
+        start += len(batch)
 
 def fetch_match_data(match_id, routing_value):
     url = f"https://{routing_value}.api.riotgames.com/lol/match/v5/matches/{match_id}"
-    resp = http.request('GET', url, headers=headers)
-    if resp.status == 429:
-        time.sleep(1)
-        return fetch_match_data(match_id, routing_value)
-    elif resp.status != 200:
+    resp = riot_get(url)
+    if resp.status != 200:
         return None
-    return json.loads(resp.data.decode('utf-8'))
+    return json_loads(resp.data)
 
-def list_existing_match_ids(puuid):
-    prefix = f"match-history/{puuid}/stats/"
+def read_daily_rollup(key):
+    """Return {matchId: json line} for a gzipped JSON Lines day file, or {} if it doesn't exist."""
+    try:
+        body = gzip.decompress(s3.get_object(Bucket=BUCKET, Key=key)['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        return {}
+    lines = body.decode('utf-8').splitlines()
+    return {json_loads(line)['matchId']: line for line in lines if line}
+
+def append_daily_rollup(key, stats_list):
+    """Merge player stats into a day file, keyed by matchId so re-fetched matches aren't duplicated."""
+    records = read_daily_rollup(key)
+    for stats in stats_list:
+        records[stats['matchId']] = json_dumps(stats)
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=key,
+        Body=gzip.compress(("\n".join(records.values()) + "\n").encode('utf-8')),
+        ContentType='application/gzip'
+    )
+
+def list_prefix_match_ids(prefix):
     existing_ids = set()
     continuation_token = None
     while True:
@@ -60,15 +177,63 @@ def list_existing_match_ids(puuid):
         if "Contents" in result:
             for obj in result["Contents"]:
                 key = obj["Key"]
-                match_id = key.split("/")[-1].replace(".json", "")
-                existing_ids.add(match_id)
+                if key.endswith(".jsonl.gz"):
+                    # Daily rollup: the match IDs are inside the file
+                    existing_ids.update(read_daily_rollup(key))
+                else:
+                    match_id = key.split("/")[-1].replace(".json", "")
+                    existing_ids.add(match_id)
         if result.get("IsTruncated"):
             continuation_token = result.get("NextContinuationToken")
         else:
             break
     return existing_ids
 
+def list_existing_match_ids(puuid):
+    # Each stats/{year}/{month}/ prefix is independent, so list them concurrently
+    prefix = f"match-history/{puuid}/stats/"
+    paginator = s3.get_paginator('list_objects_v2')
+    year_prefixes = [
+        common_prefix["Prefix"]
+        for page in paginator.paginate(Bucket=BUCKET, Prefix=prefix, Delimiter="/")
+        for common_prefix in page.get("CommonPrefixes", [])
+    ]
+    month_prefixes = [f"{year_prefix}{month:02d}/" for year_prefix in year_prefixes for month in range(1, 13)]
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        return set().union(*executor.map(list_prefix_match_ids, month_prefixes))
+
+def index_key(puuid):
+    # Lives beside stats/, so the Glue job's recursive read of stats/{year}/ never sees it
+    return f"match-history/{puuid}/_index.json"
+
+def load_existing_match_ids(puuid):
+    """
+    Return (match_ids, indexed): the stored match IDs from the index object, or from a
+    one-off listing of stats/ (indexed=False) when no index has been written yet.
+    """
+    try:
+        obj = s3.get_object(Bucket=BUCKET, Key=index_key(puuid))
+        return set(json_loads(obj['Body'].read())), True
+    except s3.exceptions.NoSuchKey:
+        return list_existing_match_ids(puuid), False
+
+def save_existing_match_ids(puuid, match_ids):
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=index_key(puuid),
+        Body=json_dumps(sorted(match_ids)),
+        ContentType='application/json'
+    )
+
 def lambda_handler(event, context):
+    try:
+        return retrieve_matches(event)
+    finally:
+        # Drain queued messages before the environment is frozen (and before a failure
+        # handler's message could overtake them)
+        ws.flush()
+
+def retrieve_matches(event):
     puuid = event['puuid']
     year = event['year']
     routing_value = event['routing_value']
@@ -77,106 +242,132 @@ def lambda_handler(event, context):
     start_of_year = int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp())
     end_of_year = int(datetime(year, 12, 31, 23, 59, 59, tzinfo=timezone.utc).timestamp())
 
-    existing_match_ids = list_existing_match_ids(puuid)
+    existing_match_ids, indexed = load_existing_match_ids(puuid)
+    indexed_count = len(existing_match_ids)
 
-    all_match_ids = []
-    start = 0
-    batch_size = 100
-    while True:
-        batch = fetch_match_ids(
-            puuid,
-            routing_value,
-            start_time=start_of_year,
-            end_time=end_of_year,
-            start=start,
-            count=batch_size
-        )
-        if not batch:
-            break
-        all_match_ids.extend(batch)
-        start += batch_size
-    new_match_ids = [m for m in all_match_ids if m not in existing_match_ids]
+    # Only the IDs not stored yet are kept; the year's total is just counted
+    total_matches = 0
+    new_match_ids = []
+    for match_id in iter_match_ids(puuid, routing_value, start_of_year, end_of_year):
+        total_matches += 1
+        if match_id not in existing_match_ids:
+            new_match_ids.append(match_id)
 
-    if connection_id:
-        api.post_to_connection(
-            ConnectionId=connection_id,
-            Data=json.dumps({"state":"START_RETRIEVE_MATCH","total":len(all_match_ids)})
-        )
+    ws.send(connection_id, json_dumps({"state":"START_RETRIEVE_MATCH","total":total_matches}))
 
-    for match_id in new_match_ids:
+    def fetch_player_stats(match_id):
+        """Fetch one match and return (day file key, player stats), or None."""
         match_data = fetch_match_data(match_id, routing_value)
-        if match_data:
-            player_stats = extract_player_stats(match_data, puuid)
-            if player_stats:
-                match_id = match_data["metadata"]["matchId"]
-                timestamp = match_data["info"]["gameStartTimestamp"] // 1000
-                dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
-                stats_key = f"match-history/{puuid}/stats/{dt.year}/{dt.month:02d}/{dt.day:02d}/{match_id}.json"
-                s3.put_object(
-                    Bucket=BUCKET,
-                    Key=stats_key,
-                    Body=json.dumps(player_stats),
-                    ContentType='application/json'
-                ) 
-                existing_match_ids.add(match_id)
-                if connection_id:
-                    api.post_to_connection(
-                        ConnectionId=connection_id,
-                        Data=json.dumps({"state":"RETRIEVING_MATCH","count":len(existing_match_ids)})
-                    )
+        if not match_data:
+            return None
+        player_stats = extract_player_stats(match_data, puuid)
+        if not player_stats:
+            return None
+        timestamp = match_data["info"]["gameStartTimestamp"] // 1000
+        dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+        day_key = f"match-history/{puuid}/stats/{dt.year}/{dt.month:02d}/{dt.day:02d}.jsonl.gz"
+        return day_key, player_stats
+
+    def post_progress():
+        ws.send(connection_id, json_dumps({"state":"RETRIEVING_MATCH","count":len(existing_match_ids)}))
+
+    # Fetch in parallel; progress is posted from this thread as results complete,
+    # coalesced to one post per PROGRESS_EVERY_MATCHES matches or PROGRESS_INTERVAL_SECONDS
+    last_post_time = time.monotonic()
+    last_post_count = len(existing_match_ids)
+    stats_by_day = defaultdict(list)
+    pending = 0
+    # Match count in the stored index (None: no index object yet, so the first flush writes one)
+    saved_count = indexed_count if indexed else None
+
+    def flush_rollups():
+        nonlocal saved_count
+        # One gzipped JSON Lines object per day instead of one object per match
+        for day_key, stats_list in stats_by_day.items():
+            append_daily_rollup(day_key, stats_list)
+        stats_by_day.clear()
+        # Every ID in existing_match_ids is now in a rollup, so the index can follow; the
+        # next run then skips these matches even if this one times out
+        if len(existing_match_ids) != saved_count:
+            save_existing_match_ids(puuid, existing_match_ids)
+            saved_count = len(existing_match_ids)
+
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    try:
+        futures = [executor.submit(fetch_player_stats, match_id) for match_id in new_match_ids]
+        for future in as_completed(futures):
+            result = future.result()
+            if result:
+                day_key, player_stats = result
+                stats_by_day[day_key].append(player_stats)
+                existing_match_ids.add(player_stats['matchId'])
+                pending += 1
+                # Flush (and index) periodically so a timed-out run keeps what it already fetched
+                if pending >= ROLLUP_FLUSH_EVERY_MATCHES:
+                    flush_rollups()
+                    pending = 0
+                now = time.monotonic()
+                if connection_id and (
+                    len(existing_match_ids) - last_post_count >= PROGRESS_EVERY_MATCHES
+                    or now - last_post_time >= PROGRESS_INTERVAL_SECONDS
+                ):
+                    post_progress()
+                    last_post_time = now
+                    last_post_count = len(existing_match_ids)
+    finally:
+        # If a fetch raised, drop the still-queued fetches rather than waiting on them,
+        # and keep (and index) everything fetched so far
+        executor.shutdown(wait=True, cancel_futures=True)
+        flush_rollups()
 
     if connection_id:
-        api.post_to_connection(
-            ConnectionId=connection_id,
-            Data=json.dumps({"state":"PROCESSING_MATCH"})
-        )
+        # Make sure the UI sees the final count
+        if len(existing_match_ids) != last_post_count:
+            post_progress()
+        ws.send(connection_id, json_dumps({"state":"PROCESSING_MATCH"}))
     
     return {
-        'complete': len(existing_match_ids) == len(all_match_ids)
+        'complete': len(existing_match_ids) == total_matches
     }
         
 
 def extract_player_stats(match_data, puuid):
     try:
-        participants = match_data['info']['participants']
-        player_data = next((p for p in participants if p['puuid'] == puuid), None)
-        if not player_data:
+        metadata = match_data['metadata']
+        info = match_data['info']
+        # metadata.participants lists PUUIDs in the same order as info.participants
+        try:
+            p = info['participants'][metadata['participants'].index(puuid)]
+        except ValueError:
             return None
+        perk_styles = p['perks']['styles']
         stats = {
-            'matchId': match_data['metadata']['matchId'],
-            'gameCreation': match_data['info']['gameCreation'],
-            'gameDuration': match_data['info']['gameDuration'],
-            'gameMode': match_data['info']['gameMode'],
-            'queueId': match_data['info']['queueId'],
-            'championName': player_data['championName'],
-            'championId': player_data['championId'],
-            'teamPosition': player_data['teamPosition'],
-            'individualPosition': player_data['individualPosition'],
-            'kills': player_data['kills'],
-            'deaths': player_data['deaths'],
-            'assists': player_data['assists'],
-            'totalMinionsKilled': player_data['totalMinionsKilled'],
-            'neutralMinionsKilled': player_data['neutralMinionsKilled'],
-            'goldEarned': player_data['goldEarned'],
-            'totalDamageDealtToChampions': player_data['totalDamageDealtToChampions'],
-            'totalDamageTaken': player_data['totalDamageTaken'],
-            'visionScore': player_data['visionScore'],
-            'win': player_data['win'],
-            'items': [
-                player_data['item0'],
-                player_data['item1'],
-                player_data['item2'],
-                player_data['item3'],
-                player_data['item4'],
-                player_data['item5'],
-                player_data['item6']
-            ],
-            'summoner1Id': player_data['summoner1Id'],
-            'summoner2Id': player_data['summoner2Id'],
+            'matchId': metadata['matchId'],
+            'gameCreation': info['gameCreation'],
+            'gameDuration': info['gameDuration'],
+            'gameMode': info['gameMode'],
+            'queueId': info['queueId'],
+            'championName': p['championName'],
+            'championId': p['championId'],
+            'teamPosition': p['teamPosition'],
+            'individualPosition': p['individualPosition'],
+            'kills': p['kills'],
+            'deaths': p['deaths'],
+            'assists': p['assists'],
+            'totalMinionsKilled': p['totalMinionsKilled'],
+            'neutralMinionsKilled': p['neutralMinionsKilled'],
+            'goldEarned': p['goldEarned'],
+            'totalDamageDealtToChampions': p['totalDamageDealtToChampions'],
+            'totalDamageTaken': p['totalDamageTaken'],
+            'visionScore': p['visionScore'],
+            'win': p['win'],
+            'items': [p[f'item{i}'] for i in range(7)],
+            'summoner1Id': p['summoner1Id'],
+            'summoner2Id': p['summoner2Id'],
             'perks': {
-                'primaryStyle': player_data['perks']['styles'][0]['style'],
-                'subStyle': player_data['perks']['styles'][1]['style'],
-                'primaryPerk': player_data['perks']['styles'][0]['selections'][0]['perk']
+                'primaryStyle': perk_styles[0]['style'],
+                'subStyle': perk_styles[1]['style'],
+                'primaryPerk': perk_styles[0]['selections'][0]['perk']
             }
         }
         return stats
@@ -0,0 +1,61 @@
+import json
+import os
+import time
+import boto3
+import urllib3
+from urllib.parse import quote
+from sdk_config import pooled_config
+
+SSM_PARAMETER_NAME = os.environ['RIOT_API_KEY_SSM_PARAM']
+
+# Set (to the extension's port) only when the Parameters and Secrets extension layer is attached
+EXTENSION_PORT = os.environ.get('PARAMETERS_SECRETS_EXTENSION_HTTP_PORT')
+API_KEY_TTL_SECONDS = 300
+
+# Local calls to the extension only; Riot traffic uses each handler's own pool
+extension_http = urllib3.PoolManager(
+    num_pools=1,
+    block=False,
+    retries=False,
+    timeout=urllib3.Timeout(connect=1.0, read=2.0)
+)
+
+_api_key = None
+_api_key_expires_at = 0.0
+_ssm = None
+
+
+def get_api_key():
+    """Return the Riot API key from Parameter Store, cached in memory for API_KEY_TTL_SECONDS."""
+    global _api_key, _api_key_expires_at, _ssm
+    if _api_key and time.monotonic() < _api_key_expires_at:
+        return _api_key
+
+    value = None
+    if EXTENSION_PORT:
+        try:
+            response = extension_http.request(
+                'GET',
+                f"http://localhost:{EXTENSION_PORT}/systemsmanager/parameters/get"
+                f"?name={quote(SSM_PARAMETER_NAME, safe='')}&withDecryption=true",
+                headers={'X-Aws-Parameters-Secrets-Token': os.environ['AWS_SESSION_TOKEN']}
+            )
+            if response.status == 200:
+                value = json.loads(response.data)['Parameter']['Value']
+            else:
+                print(f"Parameters extension returned {response.status}, falling back to SSM")
+        except urllib3.exceptions.HTTPError as e:
+            print(f"Parameters extension unavailable ({str(e)}), falling back to SSM")
+
+    if value is None:
+        if _ssm is None:
+            _ssm = boto3.client('ssm', config=pooled_config())
+        parameter = _ssm.get_parameter(
+            Name=SSM_PARAMETER_NAME,
+            WithDecryption=True
+        )
+        value = parameter['Parameter']['Value']
+
+    _api_key = value
+    _api_key_expires_at = time.monotonic() + API_KEY_TTL_SECONDS
+    return _api_key
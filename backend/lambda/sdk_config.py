@@ -0,0 +1,10 @@
+from botocore.config import Config
+
+
+def pooled_config(max_pool_connections=10):
+    """botocore Config shared by the handlers: keep SDK connections alive and pooled across warm invocations."""
+    return Config(
+        tcp_keepalive=True,
+        max_pool_connections=max_pool_connections,
+        retries={"mode": "adaptive", "max_attempts": 5}
+    )
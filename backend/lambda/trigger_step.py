@@ -1,58 +1,88 @@
-import json, boto3, os
+import json, boto3, os, hashlib, time
+from sdk_config import pooled_config
 
-sfn = boto3.client('stepfunctions')
+boto_config = pooled_config()
+
+sfn = boto3.client('stepfunctions', config=boto_config)
+ddb = boto3.client('dynamodb', config=boto_config)
 
 STATE_MACHINE_ARN = os.environ['STATE_MACHINE_ARN']
+FAST_STATE_MACHINE_ARN = os.environ['FAST_STATE_MACHINE_ARN']
 API_GATEWAY_ENDPOINT = os.environ['API_GATEWAY_ENDPOINT']
+LOCK_TABLE_NAME = os.environ['LOCK_TABLE_NAME']
+
+# Same as the standard state machine's timeout: an older lock belongs to a dead execution
+LOCK_TTL_SECONDS = 1800
+
+api = boto3.client('apigatewaymanagementapi', endpoint_url=API_GATEWAY_ENDPOINT, config=boto_config)
+
+def execution_prefix(puuid, year):
+    """Deterministic execution-name prefix for a puuid/year (a raw PUUID exceeds the 80-char name limit)."""
+    return hashlib.sha1(f"{puuid}-{year}".encode()).hexdigest()
+
+def lock_key(puuid, year):
+    # Must match the key the state machine's ReleaseLock states build ("{puuid}#{year}")
+    return {'pk': {'S': f"{puuid}#{year}"}}
+
+def acquire_lock(puuid, year):
+    """Claim the run lock for puuid/year; returns False if an unexpired lock is already held."""
+    now = int(time.time())
+    try:
+        ddb.put_item(
+            TableName=LOCK_TABLE_NAME,
+            Item={**lock_key(puuid, year), 'ttl': {'N': str(now + LOCK_TTL_SECONDS)}},
+            # TTL deletion is lazy, so a lock past its expiry counts as free too
+            ConditionExpression='attribute_not_exists(pk) OR #ttl < :now',
+            ExpressionAttributeNames={'#ttl': 'ttl'},
+            ExpressionAttributeValues={':now': {'N': str(now)}}
+        )
+        return True
+    except ddb.exceptions.ConditionalCheckFailedException:
+        return False
 
-api = boto3.client('apigatewaymanagementapi', endpoint_url=API_GATEWAY_ENDPOINT)
+def release_lock(puuid, year):
+    ddb.delete_item(TableName=LOCK_TABLE_NAME, Key=lock_key(puuid, year))
 
 def lambda_handler(event, context):
     print(event)
     connection_id = event['requestContext']['connectionId']
     body = json.loads(event['body'])
 
-    if (not body.get("summary_exists")) or (not body.get("final_exists")):
-        running_executions = []
-        next_token = None
-        
-        while True:
-            params = {
-                'stateMachineArn': STATE_MACHINE_ARN,
-                'statusFilter': 'RUNNING'
-            }
-            if next_token:
-                params['nextToken'] = next_token
-            
-            response = sfn.list_executions(**params)
-            running_executions.extend(response['executions'])
-            
-            next_token = response.get('nextToken')
-            if not next_token:
-                break
-        
-        for execution in running_executions:
-            exec_desc = sfn.describe_execution(executionArn=execution['executionArn'])
-            existing_input = json.loads(exec_desc['input'])
-            
-            if existing_input.get("puuid") == body.get("puuid") and existing_input.get("year") == body.get("year"):
-                if connection_id:
-                    api.post_to_connection(
-                        ConnectionId=connection_id,
-                        Data=json.dumps({"state":"BUSY"})
-                    )
-                return {"statusCode": 200, "body": "Execution already running"}
+    start_kwargs = {}
+    if body.get("final_exists"):
+        # Facts already generated: the EXPRESS workflow just reads and sends them
+        state_machine_arn = FAST_STATE_MACHINE_ARN
+    else:
+        state_machine_arn = STATE_MACHINE_ARN
+        # One conditional write replaces scanning the running executions; the state
+        # machine deletes the lock when the run succeeds or fails
+        if not acquire_lock(body.get("puuid"), body.get("year")):
+            if connection_id:
+                api.post_to_connection(
+                    ConnectionId=connection_id,
+                    Data=json.dumps({"state":"BUSY"})
+                )
+            return {"statusCode": 200, "body": "Execution already running"}
+        # Named "<puuid/year prefix>-<start ms>" so a player's runs are easy to find
+        prefix = execution_prefix(body.get("puuid"), body.get("year"))
+        start_kwargs['name'] = f"{prefix}-{int(time.time() * 1000)}"
     
-    sfn.start_execution(
-        stateMachineArn=STATE_MACHINE_ARN,
-        input=json.dumps({
-            "puuid": body.get("puuid"),
-            "year": body.get("year"),
-            "summary_exists": body.get("summary_exists"),
-            "final_exists": body.get("final_exists"),
-            "routing_value": body.get("routing_value"),
-            "connectionId": connection_id
-        })
-    )
+    try:
+        sfn.start_execution(
+            stateMachineArn=state_machine_arn,
+            input=json.dumps({
+                "puuid": body.get("puuid"),
+                "year": body.get("year"),
+                "summary_exists": body.get("summary_exists"),
+                "final_exists": body.get("final_exists"),
+                "routing_value": body.get("routing_value"),
+                "connectionId": connection_id
+            }),
+            **start_kwargs
+        )
+    except Exception:
+        if state_machine_arn == STATE_MACHINE_ARN:
+            release_lock(body.get("puuid"), body.get("year"))
+        raise
 
     return {"statusCode": 200, "body": "Execution started"}
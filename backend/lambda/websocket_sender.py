@@ -0,0 +1,41 @@
+import queue
+import threading
+
+
+class WebSocketSender:
+    """
+    Posts WebSocket messages from a background thread so handlers never block on API Gateway.
+    Messages are sent in order; call flush() before returning from the handler.
+    """
+
+    def __init__(self, api):
+        self.api = api
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def send(self, connection_id, data):
+        if not connection_id:
+            return
+        with self.lock:
+            # Started on first use rather than at import, so it isn't part of a SnapStart snapshot
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._pump, daemon=True)
+                self.thread.start()
+        self.queue.put((connection_id, data))
+
+    def flush(self):
+        self.queue.join()
+
+    def _pump(self):
+        while True:
+            connection_id, data = self.queue.get()
+            try:
+                self.api.post_to_connection(ConnectionId=connection_id, Data=data)
+            except self.api.exceptions.GoneException:
+                # Client disconnected; the work itself still completes and is cached in S3
+                pass
+            except Exception as e:
+                print(f"Failed to post WebSocket message: {str(e)}")
+            finally:
+                self.queue.task_done()